@@ -0,0 +1,77 @@
+"""
+Import-time benchmark for the lightweight entry points of the voyager package.
+
+Each module is imported in a fresh interpreter. The script fails if the best
+of --repeat runs exceeds the budget, or if importing it loads a heavy
+dependency that should only be imported on first use.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 300 --repeat 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "voyager",
+    "voyager.utils",
+    "voyager.utils.record_utils",
+    "voyager.prompts",
+    "voyager.control_primitives",
+]
+
+HEAVY_DEPENDENCIES = [
+    "langchain",
+    "chromadb",
+    "openai",
+    "gymnasium",
+    "requests",
+    "javascript",
+    "pkg_resources",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure(module):
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+        cwd=ROOT,
+    )
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=250.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        results = [measure(module) for _ in range(args.repeat)]
+        best_ms = min(result["elapsed"] for result in results) * 1000
+        heavy = sorted(set(name for result in results for name in result["heavy"]))
+        status = "ok"
+        if best_ms > args.budget_ms:
+            status = f"over budget ({args.budget_ms:.0f} ms)"
+        if heavy:
+            status = f"imports {', '.join(heavy)}"
+        failed = failed or status != "ok"
+        print(f"{module:<32} {best_ms:8.1f} ms  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Micro-benchmark of the JSON repair used to parse critic and curriculum responses.
+
+Every response in the corpus must parse after repair. Each is then parsed
+--repeat times, and a long response is parsed at growing sizes to check that
+the repair stays linear in the length of the response.
+
+    python benchmarks/json_repair.py
+    python benchmarks/json_repair.py --repeat 2000 --max-growth 15
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from voyager.utils.json_utils import fix_and_parse_json, repair_json  # noqa: E402
+
+# malformed responses in the shapes the critic and the task decomposition return
+CORPUS = {
+    "valid": """{
+    "reasoning": "You need to mine 3 wood logs. You have 2 oak logs and 2 spruce logs.",
+    "success": true,
+    "critique": ""
+}""",
+    "surrounding_text": """Sure, here is my assessment:
+{
+    "reasoning": "You have 5 raw_iron in your inventory.",
+    "success": true,
+    "critique": ""
+}
+Let me know if you need anything else.""",
+    "trailing_comma": """{
+    "reasoning": "You have enough materials but did not craft the pickaxe.",
+    "success": false,
+    "critique": "Craft a wooden pickaxe with a crafting table using 3 planks and 2 sticks.",
+}""",
+    "unquoted_keys": """{
+    reasoning: "Smelting raw_iron gives iron_ingot. You have 0 iron_ingot.",
+    success: false,
+    critique: "Place a furnace, then smelt raw_iron with coal as fuel."
+}""",
+    "single_quotes": """{'reasoning': 'You ate the cooked beef, hunger is 20.0/20.', 'success': True, 'critique': None}""",
+    "invalid_escapes": """{
+    "reasoning": "The path is C:\\minecraft\\saves, which is not \\relevant here.",
+    "success": false,
+    "critique": "Use \\`mineBlock\\` with a count of 3."
+}""",
+    "unescaped_quotes": """{
+    "reasoning": "You crafted a "stone pickaxe" instead of a "wooden pickaxe".",
+    "success": false,
+    "critique": "Craft the "wooden pickaxe" as asked."
+}""",
+    "quote_before_comma": """{
+    "reasoning": "You typed the word "end", ok",
+    "success": false,
+    "critique": ""
+}""",
+    "missing_comma": """{
+    "reasoning": "You have 3 oak logs."
+    "success": true
+    "critique": ""
+}""",
+    "bracketed_prose": """Based on inventory [oak_log, stick]: {"reasoning": "You crafted the pickaxe.", "success": true, "critique": ""}""",
+    "newlines_in_string": """{
+    "reasoning": "Checked the chest:
+- 3 iron ingots
+- 1 diamond",
+    "success": true,
+    "critique": ""
+}""",
+    "unclosed": """{
+    "reasoning": "You have 1 crafting_table.",
+    "success": true,
+    "critique": \"""",
+    "decomposition": """Here are the subgoals:
+["Mine 1 wood log", "Craft 4 planks", "Craft 1 crafting table", 'Craft 4 sticks', "Craft 1 wooden pickaxe",]""",
+}
+
+
+# responses that must parse to the object, not to a list before it
+EXPECT_OBJECT = {"bracketed_prose"}
+
+
+def long_response(size):
+    reasoning = "You have 2 oak logs and 2 spruce logs. " * (size // 40 + 1)
+    return f'Result: {{reasoning: "{reasoning[:size]}", success: True, critique: "",'
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=20.0,
+        help="max slowdown allowed when the response grows 10x",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for name, response in CORPUS.items():
+        _, fixes = repair_json(response)
+        try:
+            parsed = fix_and_parse_json(response)
+            if name in EXPECT_OBJECT and not isinstance(parsed, dict):
+                raise ValueError("parsed the bracketed text before the object")
+            status = ", ".join(f"{fix}={count}" for fix, count in fixes.items()) or "ok"
+        except ValueError as e:
+            status = f"failed: {e}"
+            failed = True
+        elapsed = best_of(lambda: fix_and_parse_json(response), args.repeat)
+        print(f"{name:<20} {elapsed * 1e6:9.1f} us  {status}")
+
+    previous = None
+    for size in [1_000, 10_000, 100_000]:
+        response = long_response(size)
+        elapsed = best_of(lambda: fix_and_parse_json(response), 5)
+        status = "ok"
+        if previous is not None and elapsed > previous * args.max_growth:
+            status = f"grew {elapsed / previous:.0f}x for 10x input"
+            failed = True
+        print(f"{'long ' + str(size):<20} {elapsed * 1e6:9.1f} us  {status}")
+        previous = elapsed
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,11 @@
-from .voyager import Voyager
+# Voyager pulls in langchain, chromadb, gymnasium and the javascript bridge,
+# so it is only imported when first used. voyager.utils stays cheap to import.
+__all__ = ["Voyager"]
+
+
+def __getattr__(name):
+    if name == "Voyager":
+        from .voyager import Voyager
+
+        return Voyager
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,17 @@
-from .action import ActionAgent
-from .critic import CriticAgent
-from .curriculum import CurriculumAgent
-from .skill import SkillManager
+import importlib
+
+# agents are imported on first use, each of them pulls in langchain
+_AGENTS = {
+    "ActionAgent": ".action",
+    "CriticAgent": ".critic",
+    "CurriculumAgent": ".curriculum",
+    "SkillManager": ".skill",
+}
+
+__all__ = list(_AGENTS)
+
+
+def __getattr__(name):
+    if name in _AGENTS:
+        return getattr(importlib.import_module(_AGENTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,14 +1,21 @@
+import functools
 import re
 import time
 
 import voyager.utils as U
-from javascript import require
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import SystemMessagePromptTemplate
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
 from voyager.prompts import load_prompt
 from voyager.control_primitives_context import load_control_primitives_context
+from .llm_client import create_chat_model
+from .observation import Observation
+from .streaming import code_block_complete, stream_until
+
+
+@functools.lru_cache(maxsize=8)
+def compile_system_template(system_template):
+    return SystemMessagePromptTemplate.from_template(system_template)
 
 
 class ActionAgent:
@@ -17,12 +24,15 @@ class ActionAgent:
         model_name="gpt-3.5-turbo",
         temperature=0,
         request_timout=120,
+        streaming=False,
         ckpt_dir="ckpt",
         resume=False,
         chat_log=True,
         execution_error=True,
+        checkpoint_writer=None,
     ):
         self.ckpt_dir = ckpt_dir
+        self.checkpoint_writer = checkpoint_writer or U.CheckpointWriter(ckpt_dir)
         self.chat_log = chat_log
         self.execution_error = execution_error
         U.f_mkdir(f"{ckpt_dir}/action")
@@ -31,11 +41,16 @@ class ActionAgent:
             self.chest_memory = U.load_json(f"{ckpt_dir}/action/chest_memory.json")
         else:
             self.chest_memory = {}
-        self.llm = ChatOpenAI(
+        self.llm = create_chat_model(
             model_name=model_name,
             temperature=temperature,
             request_timeout=request_timout,
+            streaming=streaming,
         )
+        # rendered system messages keyed by their inputs, the retrieved skills
+        # repeat across steps of a task
+        self.system_message_cache = {}
+        self.system_message_cache_size = 32
 
     def update_chest_memory(self, chests):
         for position, chest in chests.items():
@@ -51,7 +66,9 @@ class ActionAgent:
                 if chest != "Invalid":
                     print(f"\033[32mAction Agent saving chest {position}: {chest}\033[0m")
                     self.chest_memory[position] = chest
-        U.dump_json(self.chest_memory, f"{self.ckpt_dir}/action/chest_memory.json")
+        self.checkpoint_writer.dump_json(
+            self.chest_memory, f"{self.ckpt_dir}/action/chest_memory.json"
+        )
 
     def render_chest_observation(self):
         chests = []
@@ -90,42 +107,22 @@ class ActionAgent:
             ]
         programs = "\n\n".join(load_control_primitives_context(base_skills) + skills)
         response_format = load_prompt("action_response_format")
-        system_message_prompt = SystemMessagePromptTemplate.from_template(
-            system_template
-        )
-        system_message = system_message_prompt.format(
-            programs=programs, response_format=response_format
-        )
+        key = (system_template, programs, response_format)
+        if key not in self.system_message_cache:
+            if len(self.system_message_cache) >= self.system_message_cache_size:
+                self.system_message_cache.pop(next(iter(self.system_message_cache)))
+            system_message_prompt = compile_system_template(system_template)
+            self.system_message_cache[key] = system_message_prompt.format(
+                programs=programs, response_format=response_format
+            )
+        system_message = self.system_message_cache[key]
         assert isinstance(system_message, SystemMessage)
         return system_message
 
     def render_human_message(
-        self, *, events, code="", task="", context="", critique=""
+        self, *, events, code="", task="", context="", critique="", observation=None
     ):
-        chat_messages = []
-        error_messages = []
-        # FIXME: damage_messages is not used
-        damage_messages = []
-        assert events[-1][0] == "observe", "Last event must be observe"
-        for i, (event_type, event) in enumerate(events):
-            if event_type == "onChat":
-                chat_messages.append(event["onChat"])
-            elif event_type == "onError":
-                error_messages.append(event["onError"])
-            elif event_type == "onDamage":
-                damage_messages.append(event["onDamage"])
-            elif event_type == "observe":
-                biome = event["status"]["biome"]
-                time_of_day = event["status"]["timeOfDay"]
-                voxels = event["voxels"]
-                entities = event["status"]["entities"]
-                health = event["status"]["health"]
-                hunger = event["status"]["food"]
-                position = event["status"]["position"]
-                equipment = event["status"]["equipment"]
-                inventory_used = event["status"]["inventoryUsed"]
-                inventory = event["inventory"]
-                assert i == len(events) - 1, "observe must be the last event"
+        obs = Observation.from_events(events, observation)
 
         observation = ""
 
@@ -135,48 +132,36 @@ class ActionAgent:
             observation += f"Code from the last round: No code in the first round\n\n"
 
         if self.execution_error:
-            if error_messages:
-                error = "\n".join(error_messages)
+            if obs.error_messages:
+                error = "\n".join(obs.error_messages)
                 observation += f"Execution error:\n{error}\n\n"
             else:
                 observation += f"Execution error: No error\n\n"
 
         if self.chat_log:
-            if chat_messages:
-                chat_log = "\n".join(chat_messages)
+            if obs.chat_messages:
+                chat_log = "\n".join(obs.chat_messages)
                 observation += f"Chat log: {chat_log}\n\n"
             else:
                 observation += f"Chat log: None\n\n"
 
-        observation += f"Biome: {biome}\n\n"
+        observation += f"Biome: {obs.biome}\n\n"
 
-        observation += f"Time: {time_of_day}\n\n"
+        observation += f"Time: {obs.time_of_day}\n\n"
 
-        if voxels:
-            observation += f"Nearby blocks: {', '.join(voxels)}\n\n"
-        else:
-            observation += f"Nearby blocks: None\n\n"
+        observation += f"Nearby blocks: {obs.voxels_text}\n\n"
 
-        if entities:
-            nearby_entities = [
-                k for k, v in sorted(entities.items(), key=lambda x: x[1])
-            ]
-            observation += f"Nearby entities (nearest to farthest): {', '.join(nearby_entities)}\n\n"
-        else:
-            observation += f"Nearby entities (nearest to farthest): None\n\n"
+        observation += f"Nearby entities (nearest to farthest): {obs.entities_text}\n\n"
 
-        observation += f"Health: {health:.1f}/20\n\n"
+        observation += f"Health: {obs.health_text}\n\n"
 
-        observation += f"Hunger: {hunger:.1f}/20\n\n"
+        observation += f"Hunger: {obs.hunger_text}\n\n"
 
-        observation += f"Position: x={position['x']:.1f}, y={position['y']:.1f}, z={position['z']:.1f}\n\n"
+        observation += f"Position: {obs.position_text}\n\n"
 
-        observation += f"Equipment: {equipment}\n\n"
+        observation += f"Equipment: {obs.equipment}\n\n"
 
-        if inventory:
-            observation += f"Inventory ({inventory_used}/36): {inventory}\n\n"
-        else:
-            observation += f"Inventory ({inventory_used}/36): Empty\n\n"
+        observation += f"Inventory {obs.inventory_text}\n\n"
 
         if not (
             task == "Place and deposit useless items into a chest"
@@ -198,9 +183,15 @@ class ActionAgent:
 
         return HumanMessage(content=observation)
 
+    def generate(self, messages):
+        return stream_until(self.llm, messages, code_block_complete)
+
     def process_ai_message(self, message):
         assert isinstance(message, AIMessage)
 
+        # the javascript bridge starts a node process, only pay for it here
+        from javascript import require
+
         retry = 3
         error = None
         while retry > 0:
@@ -255,7 +246,7 @@ class ActionAgent:
                 time.sleep(1)
         return f"Error parsing action response (before program execution): {error}"
 
-    def summarize_chatlog(self, events):
+    def summarize_chatlog(self, events, observation=None):
         def filter_item(message: str):
             craft_pattern = r"I cannot make \w+ because I need: (.*)"
             craft_pattern2 = (
@@ -272,9 +263,8 @@ class ActionAgent:
                 return ""
 
         chatlog = set()
-        for event_type, event in events:
-            if event_type == "onChat":
-                item = filter_item(event["onChat"])
-                if item:
-                    chatlog.add(item)
+        for message in Observation.from_events(events, observation).chat_messages:
+            item = filter_item(message)
+            if item:
+                chatlog.add(item)
         return "I also need " + ", ".join(chatlog) + "." if chatlog else ""
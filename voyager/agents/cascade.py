@@ -0,0 +1,50 @@
+from .streaming import stream_until
+
+
+class ModelCascade:
+    """
+    Routes a request to a cheap, fast model first and escalates it to the main
+    model when `accept` rejects the fast response, e.g. because it cannot be
+    parsed or the fast model is unsure. Without a fast model every request
+    goes to the main model.
+
+    Escalations are counted so the escalation rate of each agent can be
+    checked; a fast model that is escalated most of the time only adds latency.
+    """
+
+    def __init__(self, llm, fast_llm=None, accept=None, name="Agent"):
+        self.llm = llm
+        self.fast_llm = fast_llm
+        self.accept = accept or (lambda content: True)
+        self.name = name
+        self.num_calls = 0
+        self.num_escalations = 0
+
+    @property
+    def escalation_rate(self):
+        return self.num_escalations / self.num_calls if self.num_calls else 0.0
+
+    def stats(self):
+        return {
+            "calls": self.num_calls,
+            "escalations": self.num_escalations,
+            "escalation_rate": self.escalation_rate,
+        }
+
+    def __call__(self, messages, is_complete=None, escalate=False):
+        """
+        :param is_complete: stop streaming once it accepts the text, see stream_until
+        :param escalate: skip the fast model, e.g. when retrying a response of the main model
+        """
+        if self.fast_llm is None or escalate:
+            return stream_until(self.llm, messages, is_complete)
+        self.num_calls += 1
+        message = stream_until(self.fast_llm, messages, is_complete)
+        if self.accept(message.content):
+            return message
+        self.num_escalations += 1
+        print(
+            f"\033[90m{self.name} escalating to {self.llm.model_name}, "
+            f"{self.num_escalations}/{self.num_calls} requests escalated\033[0m"
+        )
+        return stream_until(self.llm, messages, is_complete)
@@ -1,21 +1,143 @@
+import hashlib
+import json
+import time
+
+import voyager.utils as U
 from voyager.prompts import load_prompt
 from voyager.utils.json_utils import fix_and_parse_json
-from langchain.chat_models import ChatOpenAI
+from .observation import Observation
+from .cascade import ModelCascade
+from .llm_client import create_chat_model, get_llm_client
+from .streaming import json_object_complete
+from .task_utils import rule_check_task_success
 from langchain.schema import HumanMessage, SystemMessage
 
 
+def parse_critic_response(critic):
+    response = fix_and_parse_json(critic, expect="object")
+    assert response["success"] in [True, False]
+    if "critique" not in response:
+        response["critique"] = ""
+    return response["success"], response["critique"]
+
+
+def fast_critic_response_acceptable(critic):
+    """
+    A fast model verdict is kept if it parses and a failure comes with a critique.
+    """
+    try:
+        success, critique = parse_critic_response(critic)
+    except Exception:
+        return False
+    return success or bool(critique.strip())
+
+
+class VerdictCache:
+    """
+    Critic verdicts keyed by a fingerprint of what the critic sees: the task,
+    inventory, equipment, nearby blocks, hunger and chests. Retries of a task
+    that end in the same state get the earlier verdict without an LLM call.
+
+    Entries expire after `ttl` seconds, and at most `max_size` are kept, oldest
+    dropped first. With `path`, the cache is loaded from and saved to a json file.
+    """
+
+    def __init__(self, ttl=3600, max_size=1000, path=None, checkpoint_writer=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.checkpoint_writer = checkpoint_writer
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if not U.f_exists(self.path):
+            return
+        now = time.time()
+        self.entries = {
+            key: entry
+            for key, entry in U.load_json(self.path).items()
+            if not self.expired(entry, now)
+        }
+
+    @staticmethod
+    def fingerprint(*, task, observation, chest_observation):
+        state = [
+            task.strip().lower(),
+            sorted(observation.inventory.items()),
+            observation.equipment,
+            sorted(observation.voxels),
+            observation.hunger,
+            chest_observation,
+        ]
+        return hashlib.sha1(json.dumps(state).encode("utf-8")).hexdigest()
+
+    def expired(self, entry, now):
+        return self.ttl is not None and now - entry["time"] > self.ttl
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or self.expired(entry, time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["success"], entry["critique"]
+
+    def put(self, key, success, critique):
+        self.entries.pop(key, None)
+        self.entries[key] = {"success": success, "critique": critique, "time": time.time()}
+        while len(self.entries) > self.max_size:
+            self.entries.pop(next(iter(self.entries)))
+        if self.path:
+            self.checkpoint_writer.dump_json(self.entries, self.path)
+
+
 class CriticAgent:
     def __init__(
         self,
         model_name="gpt-3.5-turbo",
         temperature=0,
         request_timout=120,
+        streaming=False,
         mode="auto",
+        ckpt_dir="ckpt",
+        resume=False,
+        cache_ttl=3600,
+        checkpoint_writer=None,
+        fast_model_name=None,
     ):
-        self.llm = ChatOpenAI(
+        if cache_ttl:
+            U.f_mkdir(f"{ckpt_dir}/critic")
+            self.cache = VerdictCache(
+                ttl=cache_ttl,
+                path=f"{ckpt_dir}/critic/verdicts.json",
+                checkpoint_writer=checkpoint_writer or U.CheckpointWriter(ckpt_dir),
+            )
+            if resume:
+                print(f"\033[31mLoading Critic Agent from {ckpt_dir}/critic\033[0m")
+                self.cache.load()
+        else:
+            self.cache = None
+        self.llm = create_chat_model(
             model_name=model_name,
             temperature=temperature,
             request_timeout=request_timout,
+            streaming=streaming,
+        )
+        self.fast_llm = None
+        if fast_model_name:
+            self.fast_llm = create_chat_model(
+                model_name=fast_model_name,
+                temperature=temperature,
+                request_timeout=request_timout,
+                streaming=streaming,
+            )
+        self.cascade = ModelCascade(
+            self.llm,
+            fast_llm=self.fast_llm,
+            accept=fast_critic_response_acceptable,
+            name="Critic Agent",
         )
         assert mode in ["auto", "manual"]
         self.mode = mode
@@ -24,45 +146,31 @@ class CriticAgent:
         system_message = SystemMessage(content=load_prompt("critic"))
         return system_message
 
-    def render_human_message(self, *, events, task, context, chest_observation):
-        assert events[-1][0] == "observe", "Last event must be observe"
-        biome = events[-1][1]["status"]["biome"]
-        time_of_day = events[-1][1]["status"]["timeOfDay"]
-        voxels = events[-1][1]["voxels"]
-        health = events[-1][1]["status"]["health"]
-        hunger = events[-1][1]["status"]["food"]
-        position = events[-1][1]["status"]["position"]
-        equipment = events[-1][1]["status"]["equipment"]
-        inventory_used = events[-1][1]["status"]["inventoryUsed"]
-        inventory = events[-1][1]["inventory"]
-
-        for i, (event_type, event) in enumerate(events):
-            if event_type == "onError":
-                print(f"\033[31mCritic Agent: Error occurs {event['onError']}\033[0m")
-                return None
+    def render_human_message(
+        self, *, events, task, context, chest_observation, observation=None
+    ):
+        obs = Observation.from_events(events, observation)
+
+        if obs.num_errors:
+            print(f"\033[31mCritic Agent: Error occurs {obs.error_messages[0]}\033[0m")
+            return None
 
         observation = ""
 
-        observation += f"Biome: {biome}\n\n"
+        observation += f"Biome: {obs.biome}\n\n"
 
-        observation += f"Time: {time_of_day}\n\n"
+        observation += f"Time: {obs.time_of_day}\n\n"
 
-        if voxels:
-            observation += f"Nearby blocks: {', '.join(voxels)}\n\n"
-        else:
-            observation += f"Nearby blocks: None\n\n"
+        observation += f"Nearby blocks: {obs.voxels_text}\n\n"
 
-        observation += f"Health: {health:.1f}/20\n\n"
-        observation += f"Hunger: {hunger:.1f}/20\n\n"
+        observation += f"Health: {obs.health_text}\n\n"
+        observation += f"Hunger: {obs.hunger_text}\n\n"
 
-        observation += f"Position: x={position['x']:.1f}, y={position['y']:.1f}, z={position['z']:.1f}\n\n"
+        observation += f"Position: {obs.position_text}\n\n"
 
-        observation += f"Equipment: {equipment}\n\n"
+        observation += f"Equipment: {obs.equipment}\n\n"
 
-        if inventory:
-            observation += f"Inventory ({inventory_used}/36): {inventory}\n\n"
-        else:
-            observation += f"Inventory ({inventory_used}/36): Empty\n\n"
+        observation += f"Inventory {obs.inventory_text}\n\n"
 
         observation += chest_observation
 
@@ -88,7 +196,7 @@ class CriticAgent:
             confirmed = input("Confirm? (y/n)") in ["y", ""]
         return success, critique
 
-    def ai_check_task_success(self, messages, max_retries=5):
+    def ai_check_task_success(self, messages, max_retries=5, escalate=False, attempt=0):
         if max_retries == 0:
             print(
                 "\033[31mFailed to parse Critic Agent response. Consider updating your prompt.\033[0m"
@@ -98,29 +206,63 @@ class CriticAgent:
         if messages[1] is None:
             return False, ""
 
-        critic = self.llm(messages).content
+        critic = self.cascade(messages, json_object_complete, escalate=escalate).content
         print(f"\033[31m****Critic Agent ai message****\n{critic}\033[0m")
         try:
-            response = fix_and_parse_json(critic)
-            assert response["success"] in [True, False]
-            if "critique" not in response:
-                response["critique"] = ""
-            return response["success"], response["critique"]
+            return parse_critic_response(critic)
         except Exception as e:
             print(f"\033[31mError parsing critic response: {e} Trying again!\033[0m")
+            # unparsable responses were escalated, retry with the main model
+            get_llm_client().wait_before_retry(attempt, self.llm.model_name)
             return self.ai_check_task_success(
                 messages=messages,
                 max_retries=max_retries - 1,
+                escalate=True,
+                attempt=attempt + 1,
+            )
+
+    def rule_check_task_success(self, *, observation, task, inventory_before, known_items):
+        if observation.num_errors:
+            return None
+        verdict = rule_check_task_success(
+            task, observation, inventory_before=inventory_before, known_items=known_items
+        )
+        if verdict is not None:
+            success, critique = verdict
+            print(
+                f"\033[31m****Critic Agent rule check****\nSuccess: {success}\nCritique: {critique}\033[0m"
             )
+        return verdict
 
     def check_task_success(
-        self, *, events, task, context, chest_observation, max_retries=5
+        self,
+        *,
+        events,
+        task,
+        context,
+        chest_observation,
+        max_retries=5,
+        observation=None,
+        inventory_before=None,
+        known_items=(),
     ):
+        if self.mode == "auto":
+            observation = Observation.from_events(events, observation)
+            verdict = self.rule_check_task_success(
+                observation=observation,
+                task=task,
+                inventory_before=inventory_before,
+                known_items=known_items,
+            )
+            if verdict is not None:
+                return verdict
+
         human_message = self.render_human_message(
             events=events,
             task=task,
             context=context,
             chest_observation=chest_observation,
+            observation=observation,
         )
 
         messages = [
@@ -131,8 +273,27 @@ class CriticAgent:
         if self.mode == "manual":
             return self.human_check_task_success()
         elif self.mode == "auto":
-            return self.ai_check_task_success(
+            if human_message is None or self.cache is None:
+                return self.ai_check_task_success(
+                    messages=messages, max_retries=max_retries
+                )
+            key = VerdictCache.fingerprint(
+                task=task,
+                observation=observation,
+                chest_observation=chest_observation,
+            )
+            verdict = self.cache.get(key)
+            if verdict is not None:
+                print(
+                    f"\033[31m****Critic Agent cached verdict****\nSuccess: {verdict[0]}\nCritique: {verdict[1]}\033[0m"
+                )
+                return verdict
+            verdict = self.ai_check_task_success(
                 messages=messages, max_retries=max_retries
             )
+            if verdict != (False, ""):
+                # a failure without critique is what an unparsable response gives
+                self.cache.put(key, *verdict)
+            return verdict
         else:
             raise ValueError(f"Invalid critic agent mode: {self.mode}")
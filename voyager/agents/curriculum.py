@@ -5,13 +5,29 @@ import re
 
 import voyager.utils as U
 from voyager.prompts import load_prompt
+from voyager.tech_tree import TechTree, load_tech_tree
 from voyager.utils.json_utils import fix_and_parse_json
-from langchain.chat_models import ChatOpenAI
+from voyager.utils.task_utils import normalize_task
+from .cascade import ModelCascade
+from .llm_client import create_chat_model, get_llm_client
+from .observation import Observation
+from .streaming import stream_until, task_line_complete
+from .task_registry import TaskRegistry
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from langchain.vectorstores import Chroma
 
 
+def qa_answer_acceptable(qa_answer):
+    """
+    A fast model answer is kept unless it is malformed or unknown.
+    """
+    qa_answer = qa_answer.strip()
+    if not qa_answer.startswith("Answer:"):
+        return False
+    return qa_answer[len("Answer:") :].strip().rstrip(".").lower() not in ["", "unknown"]
+
+
 class CurriculumAgent:
     def __init__(
         self,
@@ -19,29 +35,57 @@ class CurriculumAgent:
         temperature=0,
         qa_model_name="gpt-3.5-turbo",
         qa_temperature=0,
+        qa_fast_model_name=None,
         request_timout=120,
+        streaming=False,
         ckpt_dir="ckpt",
         resume=False,
         mode="auto",
         warm_up=None,
         core_inventory_items: str | None = None,
+        checkpoint_writer=None,
+        tech_tree_max_missing=2,
+        task_similarity_threshold=None,
+        max_task_failures=2,
     ):
-        self.llm = ChatOpenAI(
+        self.llm = create_chat_model(
             model_name=model_name,
             temperature=temperature,
             request_timeout=request_timout,
+            streaming=streaming,
         )
-        self.qa_llm = ChatOpenAI(
+        self.qa_llm = create_chat_model(
             model_name=qa_model_name,
             temperature=qa_temperature,
             request_timeout=request_timout,
+            streaming=streaming,
+        )
+        self.qa_fast_llm = None
+        if qa_fast_model_name:
+            self.qa_fast_llm = create_chat_model(
+                model_name=qa_fast_model_name,
+                temperature=qa_temperature,
+                request_timeout=request_timout,
+                streaming=streaming,
+            )
+        # only answering questions goes through the fast model, asking them
+        # decides what the curriculum learns about
+        self.qa_cascade = ModelCascade(
+            self.qa_llm,
+            fast_llm=self.qa_fast_llm,
+            accept=qa_answer_acceptable,
+            name="Curriculum Agent",
         )
         assert mode in [
             "auto",
             "manual",
         ], f"mode {mode} not supported"
         self.mode = mode
+        # proposals needing more missing items than this are rejected
+        self.tech_tree_max_missing = tech_tree_max_missing
+        self.tech_tree = load_tech_tree() if tech_tree_max_missing is not None else None
         self.ckpt_dir = ckpt_dir
+        self.checkpoint_writer = checkpoint_writer or U.CheckpointWriter(ckpt_dir)
         U.f_mkdir(f"{ckpt_dir}/curriculum/vectordb")
         if resume:
             print(f"\033[35mLoading Curriculum Agent from {ckpt_dir}/curriculum\033[0m")
@@ -54,6 +98,19 @@ class CurriculumAgent:
             self.completed_tasks = []
             self.failed_tasks = []
             self.qa_cache = {}
+        # index of tried tasks, to reject proposals repeating one in other words
+        task_vectordb = None
+        if task_similarity_threshold is not None:
+            task_vectordb = Chroma(
+                collection_name="task_registry_vectordb",
+                embedding_function=OpenAIEmbeddings(),
+                persist_directory=f"{ckpt_dir}/curriculum/task_vectordb",
+            )
+        self.task_registry = TaskRegistry(
+            vectordb=task_vectordb, similarity_threshold=task_similarity_threshold
+        )
+        self.task_registry.rebuild(self.completed_tasks, self.failed_tasks)
+        self.max_task_failures = max_task_failures
         # vectordb for qa cache
         self.qa_cache_questions_vectordb = Chroma(
             collection_name="qa_cache_questions_vectordb",
@@ -136,45 +193,21 @@ class CurriculumAgent:
         assert isinstance(system_message, SystemMessage)
         return system_message
 
-    def render_observation(self, *, events, chest_observation):
-        assert events[-1][0] == "observe", "Last event must be observe"
-        event = events[-1][1]
-        biome = event["status"]["biome"]
-        time_of_day = event["status"]["timeOfDay"]
-        voxels = event["voxels"]
-        block_records = event["blockRecords"]
-        entities = event["status"]["entities"]
-        health = event["status"]["health"]
-        hunger = event["status"]["food"]
-        position = event["status"]["position"]
-        equipment = event["status"]["equipment"]
-        inventory_used = event["status"]["inventoryUsed"]
-        inventory = event["inventory"]
-
-        if not any(
-            "dirt" in block
-            or "log" in block
-            or "grass" in block
-            or "sand" in block
-            or "snow" in block
-            for block in voxels
-        ):
-            biome = "underground"
+    def render_observation(self, *, events, chest_observation, observation=None):
+        obs = Observation.from_events(events, observation)
+        biome = "underground" if obs.is_underground else obs.biome
+        inventory = obs.inventory
 
         other_blocks = ", ".join(
             list(
-                set(block_records).difference(set(voxels).union(set(inventory.keys())))
+                set(obs.block_records).difference(
+                    set(obs.voxels).union(set(inventory.keys()))
+                )
             )
         )
 
         other_blocks = other_blocks if other_blocks else "None"
 
-        nearby_entities = (
-            ", ".join([k for k, v in sorted(entities.items(), key=lambda x: x[1])])
-            if entities
-            else "None"
-        )
-
         completed_tasks = (
             ", ".join(self.completed_tasks) if self.completed_tasks else "None"
         )
@@ -191,29 +224,30 @@ class CurriculumAgent:
         observation = {
             "context": "",
             "biome": f"Biome: {biome}\n\n",
-            "time": f"Time: {time_of_day}\n\n",
-            "nearby_blocks": f"Nearby blocks: {', '.join(voxels) if voxels else 'None'}\n\n",
+            "time": f"Time: {obs.time_of_day}\n\n",
+            "nearby_blocks": f"Nearby blocks: {obs.voxels_text}\n\n",
             "other_blocks": f"Other blocks that are recently seen: {other_blocks}\n\n",
-            "nearby_entities": f"Nearby entities: {nearby_entities}\n\n",
-            "health": f"Health: {health:.1f}/20\n\n",
-            "hunger": f"Hunger: {hunger:.1f}/20\n\n",
-            "position": f"Position: x={position['x']:.1f}, y={position['y']:.1f}, z={position['z']:.1f}\n\n",
-            "equipment": f"Equipment: {equipment}\n\n",
-            "inventory": f"Inventory ({inventory_used}/36): {inventory if inventory else 'Empty'}\n\n",
+            "nearby_entities": f"Nearby entities: {obs.entities_text}\n\n",
+            "health": f"Health: {obs.health_text}\n\n",
+            "hunger": f"Hunger: {obs.hunger_text}\n\n",
+            "position": f"Position: {obs.position_text}\n\n",
+            "equipment": f"Equipment: {obs.equipment}\n\n",
+            "inventory": f"Inventory ({obs.inventory_used}/36): {inventory if inventory else 'Empty'}\n\n",
             "chests": chest_observation,
             "completed_tasks": f"Completed tasks so far: {completed_tasks}\n\n",
             "failed_tasks": f"Failed tasks that are too hard: {failed_tasks}\n\n",
         }
         return observation
 
-    def render_human_message(self, *, events, chest_observation):
+    def render_human_message(self, *, events, chest_observation, observation=None):
         content = ""
+        obs = Observation.from_events(events, observation)
         observation = self.render_observation(
-            events=events, chest_observation=chest_observation
+            events=events, chest_observation=chest_observation, observation=obs
         )
         if self.progress >= self.warm_up["context"]:
             questions, answers = self.run_qa(
-                events=events, chest_observation=chest_observation
+                events=events, chest_observation=chest_observation, observation=obs
             )
             i = 1
             for question, answer in zip(questions, answers):
@@ -237,7 +271,9 @@ class CurriculumAgent:
         print(f"\033[35m****Curriculum Agent human message****\n{content}\033[0m")
         return HumanMessage(content=content)
 
-    def propose_next_task(self, *, events, chest_observation, max_retries=5):
+    def propose_next_task(
+        self, *, events, chest_observation, max_retries=5, observation=None
+    ):
         if self.progress == 0 and self.mode == "auto":
             task = "Mine 1 wood log"
             context = "You can mine one of oak, birch, spruce, jungle, acacia, dark oak, or mangrove logs."
@@ -275,38 +311,113 @@ class CurriculumAgent:
                 context = "Craft 1 chest with 8 planks of any kind of wood."
             return task, context
 
+        observation = Observation.from_events(events, observation)
         messages = [
             self.render_system_message(),
             self.render_human_message(
-                events=events, chest_observation=chest_observation
+                events=events, chest_observation=chest_observation, observation=observation
             ),
         ]
 
         if self.mode == "auto":
-            return self.propose_next_ai_task(messages=messages, max_retries=max_retries)
+            inventory = list(observation.inventory) + [
+                item for item in observation.equipment if item
+            ]
+            # a crafting table or furnace placed nearby need not be crafted again
+            inventory += [
+                block for block in observation.voxels if block in TechTree.STATIONS
+            ]
+            return self.propose_next_ai_task(
+                messages=messages, max_retries=max_retries, inventory=inventory
+            )
         elif self.mode == "manual":
             return self.propose_next_manual_task()
         else:
             raise ValueError(f"Invalid curriculum agent mode: {self.mode}")
 
-    def propose_next_ai_task(self, *, messages, max_retries=5):
+    def propose_next_ai_task(self, *, messages, max_retries=5, inventory=None, attempt=0):
         if max_retries == 0:
             raise RuntimeError("Max retries reached, failed to propose ai task.")
-        curriculum = self.llm(messages).content
+        curriculum = stream_until(self.llm, messages, task_line_complete).content
         print(f"\033[31m****Curriculum Agent ai message****\n{curriculum}\033[0m")
         try:
             response = self.parse_ai_message(curriculum)
             assert "next_task" in response
-            context = self.get_task_context(response["next_task"])
-            return response["next_task"], context
+            feedback = self.check_task_repeated(
+                response["next_task"]
+            ) or self.check_task_feasible(response["next_task"], inventory)
+            # the last retry is accepted, an infeasible task still beats none
+            if feedback is None or max_retries == 1:
+                context = self.get_task_context(response["next_task"])
+                return response["next_task"], context
         except Exception as e:
             print(
                 f"\033[35mError parsing curriculum response: {e}. Trying again!\033[0m"
             )
+            get_llm_client().wait_before_retry(attempt, self.llm.model_name)
             return self.propose_next_ai_task(
                 messages=messages,
                 max_retries=max_retries - 1,
+                inventory=inventory,
+                attempt=attempt + 1,
             )
+        return self.propose_next_ai_task(
+            messages=messages
+            + [
+                AIMessage(content=curriculum),
+                HumanMessage(content=feedback),
+            ],
+            max_retries=max_retries - 1,
+            inventory=inventory,
+            attempt=attempt + 1,
+        )
+
+    def check_task_repeated(self, task):
+        """
+        Returns: feedback asking for another task if the task repeats a tried
+        one, or None if it is new enough
+        """
+        key = self.task_registry.lookup(task)
+        if key is None:
+            return None
+        known = self.task_registry.tasks[key]
+        if self.task_registry.completed[key]:
+            feedback = (
+                f"{task} was already completed as {known}. Propose a new task, "
+                "or a larger quantity if more is needed."
+            )
+        elif self.task_registry.failed[key] >= self.max_task_failures:
+            feedback = (
+                f"{task} already failed {self.task_registry.failed[key]} times as "
+                f"{known}. Propose a different task."
+            )
+        else:
+            return None
+        print(f"\033[35mCurriculum Agent rejected {task}: {feedback}\033[0m")
+        return feedback
+
+    def check_task_feasible(self, task, inventory):
+        """
+        Returns: feedback asking for a reachable task if the tech tree rejects
+        the task, or None if it is feasible
+        """
+        if self.tech_tree is None or inventory is None:
+            return None
+        feasible, missing = self.tech_tree.check_task(
+            task, inventory, max_missing=self.tech_tree_max_missing
+        )
+        if feasible:
+            return None
+        if missing:
+            reason = f"it first needs {', '.join(missing)}"
+        else:
+            reason = "it cannot be obtained"
+        feedback = (
+            f"{task} is not reachable yet, {reason}. "
+            "Propose a task that can be done with the current inventory."
+        )
+        print(f"\033[35mCurriculum Agent rejected {task}: {reason}\033[0m")
+        return feedback
 
     def parse_ai_message(self, message):
         task = ""
@@ -339,32 +450,31 @@ class CurriculumAgent:
                 f"\033[35mFailed to complete task {task}. Skipping to next task.\033[0m"
             )
             self.failed_tasks.append(task)
+        self.task_registry.add(task, info["success"])
+        if self.task_registry.vectordb is not None:
+            self.checkpoint_writer.after_commit(self.task_registry.vectordb.persist)
 
         # clean up tasks and dump to disk
         self.clean_up_tasks()
 
     def clean_up_tasks(self):
-        updated_completed_tasks = []
-        # record repeated failed tasks
-        updated_failed_tasks = self.failed_tasks
-        # dedup but keep order
+        # dedup equivalent tasks but keep order, the first wording is kept
+        completed = {}
         for task in self.completed_tasks:
-            if task not in updated_completed_tasks:
-                updated_completed_tasks.append(task)
-
-        # remove completed tasks from failed tasks
-        for task in updated_completed_tasks:
-            while task in updated_failed_tasks:
-                updated_failed_tasks.remove(task)
-
-        self.completed_tasks = updated_completed_tasks
-        self.failed_tasks = updated_failed_tasks
+            completed.setdefault(normalize_task(task), task)
+        self.completed_tasks = list(completed.values())
+        # remove completed tasks from failed tasks, repeated failures are kept
+        self.failed_tasks = [
+            task for task in self.failed_tasks if normalize_task(task) not in completed
+        ]
 
         # dump to json
-        U.dump_json(
+        self.checkpoint_writer.dump_json(
             self.completed_tasks, f"{self.ckpt_dir}/curriculum/completed_tasks.json"
         )
-        U.dump_json(self.failed_tasks, f"{self.ckpt_dir}/curriculum/failed_tasks.json")
+        self.checkpoint_writer.dump_json(
+            self.failed_tasks, f"{self.ckpt_dir}/curriculum/failed_tasks.json"
+        )
 
     def decompose_task(self, task, events):
         messages = [
@@ -377,13 +487,13 @@ class CurriculumAgent:
         print(
             f"\033[31m****Curriculum Agent task decomposition****\nFinal task: {task}\033[0m"
         )
-        response = self.llm(messages).content
+        response = get_llm_client().call(self.llm, messages).content
         print(f"\033[31m****Curriculum Agent task decomposition****\n{response}\033[0m")
-        return fix_and_parse_json(response)
+        return fix_and_parse_json(response, expect="array")
 
-    def run_qa(self, *, events, chest_observation):
+    def run_qa(self, *, events, chest_observation, observation=None):
         questions_new, _ = self.run_qa_step1_ask_questions(
-            events=events, chest_observation=chest_observation
+            events=events, chest_observation=chest_observation, observation=observation
         )
         questions = []
         answers = []
@@ -407,8 +517,12 @@ class CurriculumAgent:
             self.qa_cache_questions_vectordb.add_texts(
                 texts=[question],
             )
-            U.dump_json(self.qa_cache, f"{self.ckpt_dir}/curriculum/qa_cache.json")
-            self.qa_cache_questions_vectordb.persist()
+            self.checkpoint_writer.dump_json(
+                self.qa_cache, f"{self.ckpt_dir}/curriculum/qa_cache.json"
+            )
+            self.checkpoint_writer.after_commit(
+                self.qa_cache_questions_vectordb.persist
+            )
             questions.append(question)
             answers.append(answer)
         assert len(questions_new) == len(questions) == len(answers)
@@ -428,25 +542,31 @@ class CurriculumAgent:
             self.qa_cache_questions_vectordb.add_texts(
                 texts=[question],
             )
-            U.dump_json(self.qa_cache, f"{self.ckpt_dir}/curriculum/qa_cache.json")
-            self.qa_cache_questions_vectordb.persist()
+            self.checkpoint_writer.dump_json(
+                self.qa_cache, f"{self.ckpt_dir}/curriculum/qa_cache.json"
+            )
+            self.checkpoint_writer.after_commit(
+                self.qa_cache_questions_vectordb.persist
+            )
         context = f"Question: {question}\n{answer}"
         return context
 
     def render_system_message_qa_step1_ask_questions(self):
         return SystemMessage(content=load_prompt("curriculum_qa_step1_ask_questions"))
 
-    def render_human_message_qa_step1_ask_questions(self, *, events, chest_observation):
+    def render_human_message_qa_step1_ask_questions(
+        self, *, events, chest_observation, observation=None
+    ):
         observation = self.render_observation(
-            events=events, chest_observation=chest_observation
+            events=events, chest_observation=chest_observation, observation=observation
         )
         content = ""
         for key in self.curriculum_observations:
             content += observation[key]
         return HumanMessage(content=content)
 
-    def run_qa_step1_ask_questions(self, *, events, chest_observation):
-        biome = events[-1][1]["status"]["biome"].replace("_", " ")
+    def run_qa_step1_ask_questions(self, *, events, chest_observation, observation=None):
+        biome = Observation.from_events(events, observation).biome.replace("_", " ")
         questions = [
             f"What are the blocks that I can find in the {biome} in Minecraft?",
             f"What are the items that I can find in the {biome} in Minecraft?",
@@ -456,10 +576,10 @@ class CurriculumAgent:
         messages = [
             self.render_system_message_qa_step1_ask_questions(),
             self.render_human_message_qa_step1_ask_questions(
-                events=events, chest_observation=chest_observation
+                events=events, chest_observation=chest_observation, observation=observation
             ),
         ]
-        qa_response = self.qa_llm(messages).content
+        qa_response = get_llm_client().call(self.qa_llm, messages).content
         try:
             # Regex pattern to extract question and concept pairs
             pattern = r"Question \d+: (.+)\nConcept \d+: (.+)"
@@ -493,6 +613,6 @@ class CurriculumAgent:
             self.render_human_message_qa_step2_answer_questions(question=question),
         ]
         print(f"\033[35mCurriculum Agent Question: {question}\033[0m")
-        qa_answer = self.qa_llm(messages).content
+        qa_answer = self.qa_cascade(messages).content
         print(f"\033[31mCurriculum Agent {qa_answer}\033[0m")
         return qa_answer
@@ -0,0 +1,273 @@
+"""
+Shared access to the chat models of all agents.
+
+Every request goes through one `LLMClient`, which rate limits each model with
+a token bucket, bounds the number of requests in flight, retries transport
+errors with jittered exponential backoff and pauses all agents while a model
+keeps failing (circuit breaker). Chat models are created without their own
+retries so a burst of 429s is not multiplied by every agent.
+"""
+import collections
+import random
+import threading
+import time
+
+
+def retryable_errors():
+    import openai
+
+    return (
+        openai.error.RateLimitError,
+        openai.error.APIError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain,
+    )
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if needed.
+
+        Returns: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """
+        Empty the bucket, e.g. after the server rejected a request with 429.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures. While open, requests wait
+    until the cooldown is over; each failure after reopening doubles the
+    cooldown up to `max_cooldown`.
+    """
+
+    def __init__(self, threshold=5, cooldown=10.0, max_cooldown=120.0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.num_opens = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Returns: seconds waited for the breaker to close
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            delay = self.opened_at + self.cooldown - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        """
+        Returns: True if this failure opened the breaker
+        """
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return False
+            if self.opened_at is not None:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.opened_at = time.monotonic()
+            self.num_opens += 1
+            return True
+
+
+class LLMClient:
+    """
+    :param requests_per_minute: per model limit, None for no limit
+    :param max_concurrency: requests in flight across all models
+    :param max_retries: attempts per request after the first one
+    :param backoff: base delay in seconds of the exponential backoff
+    :param max_backoff: cap of a single backoff delay
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=None,
+        max_concurrency=4,
+        max_retries=6,
+        backoff=1.0,
+        max_backoff=60.0,
+        breaker_threshold=5,
+        breaker_cooldown=10.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.buckets = {}
+        self.breakers = {}
+        self.metrics = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    def _bucket(self, model_name):
+        if not self.requests_per_minute:
+            return None
+        with self.lock:
+            if model_name not in self.buckets:
+                self.buckets[model_name] = TokenBucket(self.requests_per_minute / 60)
+            return self.buckets[model_name]
+
+    def _breaker(self, model_name):
+        with self.lock:
+            if model_name not in self.breakers:
+                self.breakers[model_name] = CircuitBreaker(
+                    threshold=self.breaker_threshold, cooldown=self.breaker_cooldown
+                )
+            return self.breakers[model_name]
+
+    def backoff_delay(self, attempt):
+        """
+        Full jitter: a random delay up to backoff * 2 ** attempt, so agents
+        retrying at the same time spread out.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def wait_before_retry(self, attempt, model_name):
+        """
+        Back off before asking `model_name` again after an unusable response.
+        """
+        delay = self.backoff_delay(attempt)
+        self.metrics[model_name]["parse_retries"] += 1
+        self.metrics[model_name]["backoff_seconds"] += delay
+        time.sleep(delay)
+
+    def call(self, llm, messages, **kwargs):
+        """
+        Call `llm` on `messages`, keyword arguments are passed on to it.
+        Errors other than transport errors, e.g. an early stop raised by a
+        streaming callback, are passed through without retrying.
+        """
+        model_name = llm.model_name
+        metrics = self.metrics[model_name]
+        breaker = self._breaker(model_name)
+        bucket = self._bucket(model_name)
+        errors = retryable_errors()
+        attempt = 0
+        while True:
+            waited = breaker.wait()
+            if waited:
+                metrics["breaker_seconds"] += waited
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited:
+                    metrics["throttled"] += 1
+                    metrics["throttled_seconds"] += waited
+            metrics["requests"] += 1
+            try:
+                with self.semaphore:
+                    response = llm(messages, **kwargs)
+            except errors as e:
+                metrics["errors"] += 1
+                if e.__class__.__name__ == "RateLimitError":
+                    metrics["rate_limited"] += 1
+                    if bucket is not None:
+                        bucket.drain()
+                if breaker.record_failure():
+                    metrics["breaker_opens"] += 1
+                    print(
+                        f"\033[33mToo many failed requests to {model_name}, "
+                        f"pausing for {breaker.cooldown:.0f} seconds\033[0m"
+                    )
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(
+                    f"\033[33m{e.__class__.__name__} from {model_name}, "
+                    f"retrying in {delay:.1f} seconds\033[0m"
+                )
+                metrics["retries"] += 1
+                metrics["backoff_seconds"] += delay
+                time.sleep(delay)
+                attempt += 1
+            except Exception:
+                breaker.record_success()
+                raise
+            else:
+                breaker.record_success()
+                return response
+
+    def stats(self):
+        return {model_name: dict(metrics) for model_name, metrics in self.metrics.items()}
+
+
+_client = LLMClient()
+
+
+def get_llm_client():
+    return _client
+
+
+def configure_llm_client(**kwargs):
+    """
+    Replace the shared client, see LLMClient for the options.
+    """
+    global _client
+    _client = LLMClient(**kwargs)
+    return _client
+
+
+def create_chat_model(model_name, temperature, request_timeout, streaming=False):
+    """
+    A chat model for the shared client. Its own retries are turned off, the
+    client retries instead.
+    """
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        request_timeout=request_timeout,
+        streaming=streaming,
+        max_retries=1,
+    )
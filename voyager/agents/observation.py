@@ -0,0 +1,105 @@
+from functools import cached_property
+
+
+class Observation:
+    """
+    The events of one env step, parsed once and shared by all agents.
+
+    Fields come from the final observe event. Chat, error and damage messages
+    are collected from the events before it. The text renderings are computed
+    on first use and memoized, so the action, critic and curriculum agents
+    format them only once per step.
+    """
+
+    def __init__(self, events):
+        assert events[-1][0] == "observe", "Last event must be observe"
+        self.events = events
+        event = events[-1][1]
+        status = event["status"]
+        self.biome = status["biome"]
+        self.time_of_day = status["timeOfDay"]
+        self.voxels = event["voxels"]
+        self.block_records = event["blockRecords"]
+        self.entities = status["entities"]
+        self.health = status["health"]
+        self.hunger = status["food"]
+        self.position = status["position"]
+        self.equipment = status["equipment"]
+        self.inventory_used = status["inventoryUsed"]
+        self.inventory = event["inventory"]
+        self.nearby_chests = event["nearbyChests"]
+        self.chat_messages = []
+        self.error_messages = []
+        self.damage_messages = []
+        self.num_errors = 0
+        for event_type, event in events[:-1]:
+            if event_type == "truncated":
+                num_chats = event["truncated"]["eventTypes"].get("onChat", 0)
+                num_errors = event["truncated"]["eventTypes"].get("onError", 0)
+                if num_chats:
+                    self.chat_messages.append(f"({num_chats} earlier messages omitted)")
+                if num_errors:
+                    self.error_messages.append(f"({num_errors} earlier errors omitted)")
+                self.num_errors += num_errors
+            elif event_type == "onChat":
+                self.chat_messages.append(event["onChat"])
+            elif event_type == "onError":
+                self.error_messages.append(event["onError"])
+                self.num_errors += 1
+            elif event_type == "onDamage":
+                self.damage_messages.append(event["onDamage"])
+            elif event_type == "observe":
+                raise AssertionError("observe must be the last event")
+
+    @classmethod
+    def from_events(cls, events, observation=None):
+        """
+        Returns: `observation` if one was already built for these events
+        """
+        if observation is not None:
+            assert observation.events is events, "observation is for other events"
+            return observation
+        return cls(events)
+
+    @cached_property
+    def nearby_entities(self):
+        """
+        Returns: entity names, nearest first
+        """
+        return [name for name, _ in sorted(self.entities.items(), key=lambda x: x[1])]
+
+    @cached_property
+    def voxels_text(self):
+        return ", ".join(self.voxels) if self.voxels else "None"
+
+    @cached_property
+    def entities_text(self):
+        return ", ".join(self.nearby_entities) if self.nearby_entities else "None"
+
+    @cached_property
+    def health_text(self):
+        return f"{self.health:.1f}/20"
+
+    @cached_property
+    def hunger_text(self):
+        return f"{self.hunger:.1f}/20"
+
+    @cached_property
+    def position_text(self):
+        position = self.position
+        return f"x={position['x']:.1f}, y={position['y']:.1f}, z={position['z']:.1f}"
+
+    @cached_property
+    def inventory_text(self):
+        return f"({self.inventory_used}/36): {self.inventory if self.inventory else 'Empty'}"
+
+    @cached_property
+    def is_underground(self):
+        return not any(
+            "dirt" in block
+            or "log" in block
+            or "grass" in block
+            or "sand" in block
+            or "snow" in block
+            for block in self.voxels
+        )
@@ -1,13 +1,14 @@
 import os
 
 import voyager.utils as U
-from langchain.chat_models import ChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.vectorstores import Chroma
 
 from voyager.prompts import load_prompt
 from voyager.control_primitives import load_control_primitives
+from voyager.utils.task_utils import parse_task, program_task, task_topic
+from .llm_client import create_chat_model, get_llm_client
 
 
 class SkillManager:
@@ -17,14 +18,19 @@ class SkillManager:
         temperature=0,
         retrieval_top_k=5,
         request_timout=120,
+        streaming=False,
         ckpt_dir="ckpt",
         resume=False,
+        checkpoint_writer=None,
+        replay_threshold=None,
     ):
-        self.llm = ChatOpenAI(
+        self.llm = create_chat_model(
             model_name=model_name,
             temperature=temperature,
             request_timeout=request_timout,
+            streaming=streaming,
         )
+        self.checkpoint_writer = checkpoint_writer or U.CheckpointWriter(ckpt_dir)
         U.f_mkdir(f"{ckpt_dir}/skill/code")
         U.f_mkdir(f"{ckpt_dir}/skill/description")
         U.f_mkdir(f"{ckpt_dir}/skill/vectordb")
@@ -48,6 +54,11 @@ class SkillManager:
             f"Did you set resume=False when initializing the manager?\n"
             f"You may need to manually delete the vectordb directory for running from scratch."
         )
+        # skills by the task they solved, and by the task their name reads as
+        self.replay_threshold = replay_threshold
+        self.task_index = {}
+        for program_name, entry in self.skills.items():
+            self.index_skill(program_name, entry)
 
     @property
     def programs(self):
@@ -58,10 +69,58 @@ class SkillManager:
             programs += f"{primitives}\n\n"
         return programs
 
+    def index_skill(self, program_name, entry):
+        """
+        Index a skill by the task it solved and by the task its name reads as.
+        A solved task takes precedence over any name for the same topic.
+        """
+        solved = entry.get("task")
+        topic = task_topic(program_task(program_name))
+        if topic not in self.task_index or not self.task_index[topic][1]:
+            self.task_index[topic] = (program_name, False)
+        if solved is not None:
+            self.task_index[task_topic(solved)] = (program_name, True)
+
+    def solved_count(self, program_name):
+        """
+        Returns: the quantity the skill is known to reach, e.g. 3 for
+        mineThreeIronOre, or 1 if its task has no quantity, as for legacy
+        skills named after an action only
+        """
+        entry = self.skills[program_name]
+        parsed = parse_task(entry.get("task") or program_task(program_name))
+        return parsed["count"] if parsed else 1
+
+    def find_replay_skill(self, task):
+        """
+        Returns: the name of the skill to replay for `task`, or None. Skills are
+        matched by task and name, and, with a replay threshold, by the distance
+        of their description to the task. A skill only replays for a quantity
+        up to the one it solved, since skills usually hard-code it.
+        """
+        program_name = None
+        if task_topic(task) in self.task_index:
+            program_name = self.task_index[task_topic(task)][0]
+        elif self.replay_threshold is not None and self.vectordb._collection.count():
+            doc, distance = self.vectordb.similarity_search_with_score(task, k=1)[0]
+            if distance <= self.replay_threshold:
+                program_name = doc.metadata["name"]
+        if program_name is None:
+            return None
+        parsed = parse_task(task)
+        if parsed is not None:
+            count = self.solved_count(program_name)
+            if parsed["count"] > count:
+                return None
+        return program_name
+
     def add_new_skill(self, info):
         if info["task"].startswith("Deposit useless items into the chest at"):
             # No need to reuse the deposit skill
             return
+        if info.get("replayed"):
+            # the skill was replayed from the library, nothing new to add
+            return
         program_name = info["program_name"]
         program_code = info["program_code"]
         skill_description = self.generate_skill_description(program_name, program_code)
@@ -85,19 +144,23 @@ class SkillManager:
         self.skills[program_name] = {
             "code": program_code,
             "description": skill_description,
+            "task": info["task"],
         }
+        self.index_skill(program_name, self.skills[program_name])
         assert self.vectordb._collection.count() == len(
             self.skills
         ), "vectordb is not synced with skills.json"
-        U.dump_text(
+        self.checkpoint_writer.dump_text(
             program_code, f"{self.ckpt_dir}/skill/code/{dumped_program_name}.js"
         )
-        U.dump_text(
+        self.checkpoint_writer.dump_text(
             skill_description,
             f"{self.ckpt_dir}/skill/description/{dumped_program_name}.txt",
         )
-        U.dump_json(self.skills, f"{self.ckpt_dir}/skill/skills.json")
-        self.vectordb.persist()
+        self.checkpoint_writer.dump_json(
+            self.skills, f"{self.ckpt_dir}/skill/skills.json"
+        )
+        self.checkpoint_writer.after_commit(self.vectordb.persist)
 
     def generate_skill_description(self, program_name, program_code):
         messages = [
@@ -108,7 +171,7 @@ class SkillManager:
                 + f"The main function is `{program_name}`."
             ),
         ]
-        skill_description = f"    // { self.llm(messages).content}"
+        skill_description = f"    // { get_llm_client().call(self.llm, messages).content}"
         return f"async function {program_name}(bot) {{\n{skill_description}\n}}"
 
     def retrieve_skills(self, query):
@@ -0,0 +1,105 @@
+import re
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AIMessage
+
+from .llm_client import get_llm_client
+
+MAIN_FUNCTION = re.compile(r"async\s+function\s+\w+\s*\(\s*bot\s*\)")
+
+
+class StopStreaming(Exception):
+    def __init__(self, text):
+        super().__init__("response complete")
+        self.text = text
+
+
+class EarlyStopHandler(BaseCallbackHandler):
+    """
+    Collects streamed tokens and stops the completion once `is_complete`
+    accepts the text so far. Stopping is done by raising from the callback,
+    which langchain only propagates for handlers with raise_error set.
+    """
+
+    raise_error = True
+
+    def __init__(self, is_complete):
+        self.is_complete = is_complete
+        self.text = ""
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        if self.is_complete(self.text):
+            raise StopStreaming(self.text)
+
+
+def stream_until(llm, messages, is_complete=None):
+    """
+    Call a chat model and return its message as soon as `is_complete` accepts
+    the streamed text, instead of waiting for the whole completion. Models
+    created without streaming=True are called as usual.
+    """
+    client = get_llm_client()
+    if not is_complete or not getattr(llm, "streaming", False):
+        return client.call(llm, messages)
+    handler = EarlyStopHandler(is_complete)
+    try:
+        return client.call(llm, messages, callbacks=[handler])
+    except StopStreaming as e:
+        print(f"\033[90mStopped streaming after {len(e.text)} characters\033[0m")
+        return AIMessage(content=e.text)
+
+
+def code_block_complete(text):
+    """
+    The action agent response is complete once the javascript block with the
+    main function, which comes after the helpers, is closed and followed by a
+    full line of text outside any code block. All code blocks are parsed, so
+    stopping at the first one could cut off code in a later block.
+    """
+    if text.count("```") < 2:
+        return False
+    blocks = list(re.finditer(r"```(?:javascript|js).*?```", text, re.DOTALL))
+    if not blocks or not MAIN_FUNCTION.search(blocks[-1].group()):
+        return False
+    rest = text[blocks[-1].end() :]
+    return "```" not in rest and re.search(r"^.*\S.*\n", rest, re.MULTILINE) is not None
+
+
+def task_line_complete(text):
+    """
+    The curriculum agent response is complete once a Task: line is finished.
+    """
+    return re.search(r"^Task:.*\n", text, re.MULTILINE) is not None
+
+
+def json_object_complete(text):
+    """
+    The critic response is complete once its first JSON object is balanced.
+    """
+    start = text.find("{")
+    if start < 0:
+        return False
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
@@ -0,0 +1,61 @@
+import collections
+
+from voyager.utils.task_utils import normalize_task
+
+
+class TaskRegistry:
+    """
+    Outcomes of the tasks tried so far, indexed by normalized task key, so the
+    curriculum can tell that a proposal repeats an earlier task in other words.
+
+    With a `vectordb`, keys are also embedded and a proposal within
+    `similarity_threshold` (a distance, lower is closer) of a known key counts
+    as the same task.
+    """
+
+    def __init__(self, vectordb=None, similarity_threshold=None):
+        self.tasks = {}
+        self.completed = collections.Counter()
+        self.failed = collections.Counter()
+        self.vectordb = vectordb
+        self.similarity_threshold = similarity_threshold
+        if vectordb is not None:
+            self._indexed = set(vectordb._collection.get()["ids"])
+        else:
+            self._indexed = set()
+
+    def add(self, task, success):
+        key = normalize_task(task)
+        self.tasks.setdefault(key, task)
+        if success:
+            self.completed[key] += 1
+        else:
+            self.failed[key] += 1
+        if self.vectordb is not None and key not in self._indexed:
+            self.vectordb.add_texts(texts=[key], ids=[key])
+            self._indexed.add(key)
+
+    def rebuild(self, completed_tasks, failed_tasks):
+        self.tasks.clear()
+        self.completed.clear()
+        self.failed.clear()
+        for task in completed_tasks:
+            self.add(task, True)
+        for task in failed_tasks:
+            self.add(task, False)
+
+    def lookup(self, task):
+        """
+        Returns: the key of the known task equivalent to `task`, or None
+        """
+        key = normalize_task(task)
+        if key in self.tasks:
+            return key
+        if self.vectordb is None or self.similarity_threshold is None:
+            return None
+        if not self._indexed:
+            return None
+        doc, distance = self.vectordb.similarity_search_with_score(key, k=1)[0]
+        if distance <= self.similarity_threshold and doc.page_content in self.tasks:
+            return doc.page_content
+        return None
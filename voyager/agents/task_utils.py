@@ -0,0 +1,62 @@
+from voyager.utils.task_utils import item_keys, item_matches, parse_task, singular
+
+
+def count_items(inventory, keys):
+    return sum(count for item, count in inventory.items() if item_matches(item, keys))
+
+
+def count_kills(events, mob):
+    names = {f"{mob}_killed", f"{singular(mob)}_killed"}
+    return sum(
+        1
+        for event_type, event in events
+        if event_type == "onSave" and event["onSave"] in names
+    )
+
+
+def rule_check_task_success(task, observation, inventory_before=None, known_items=()):
+    """
+    Decide tasks that the inventory settles without asking the LLM critic.
+
+    :param task: the task, e.g. "Craft 1 chest"
+    :param observation: the Observation of the step
+    :param inventory_before: the inventory before the step, if known
+    :param known_items: item names seen so far, to tell a missing item from a misspelled one
+    :return: (success, critique), or None if the task needs the LLM critic
+    """
+    parsed = parse_task(task)
+    if parsed is None:
+        return None
+    verb, count, name = parsed["verb"], parsed["count"], parsed["name"]
+    if verb == "kill":
+        kills = count_kills(observation.events, name)
+        if kills >= count:
+            return True, ""
+        return None
+
+    if verb == "smelt" and (name.startswith("raw_") or name.endswith("_ore")):
+        # names the input, not the product
+        return None
+    keys = item_keys(verb, name)
+    # armor and offhand, the held item is already part of the inventory
+    equipment = observation.equipment
+    equipped = [item for item in equipment[:4] + equipment[5:6] if item]
+    after = count_items(observation.inventory, keys) + sum(
+        1 for item in equipped if item_matches(item, keys)
+    )
+    # like the LLM critic, judge the inventory the task ends with: a task
+    # often takes several attempts, and each one only sees its own step
+    if after >= count:
+        return True, ""
+    if inventory_before is None or after > count_items(inventory_before, keys):
+        # some progress, let the critic give a precise critique
+        return None
+    items = set(known_items) | set(observation.inventory) | set(equipped)
+    if not any(item_matches(item, keys) for item in items):
+        # the name may not be an item, e.g. "Mine 3 wood", or it was never seen
+        return None
+    item = " ".join(name.split("_"))
+    return False, (
+        f"You have {after} {item}, the task needs {count}. "
+        f"{verb.capitalize()} {count - after} more {item}."
+    )
@@ -1,18 +1,24 @@
-import pkg_resources
+import functools
 import os
+
 import voyager.utils as U
 
 
+@functools.lru_cache(maxsize=None)
+def _list_primitive_names(package_path):
+    return [
+        primitives[:-3]
+        for primitives in sorted(os.listdir(package_path))
+        if primitives.endswith(".js")
+    ]
+
+
 def load_control_primitives(primitive_names=None):
-    package_path = pkg_resources.resource_filename("voyager", "")
+    package_path = os.path.dirname(os.path.abspath(__file__))
     if primitive_names is None:
-        primitive_names = [
-            primitives[:-3]
-            for primitives in os.listdir(f"{package_path}/control_primitives")
-            if primitives.endswith(".js")
-        ]
+        primitive_names = _list_primitive_names(package_path)
     primitives = [
-        U.load_text(f"{package_path}/control_primitives/{primitive_name}.js")
+        U.load_text_cached(f"{package_path}/{primitive_name}.js")
         for primitive_name in primitive_names
     ]
     return primitives
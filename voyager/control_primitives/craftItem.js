@@ -1,4 +1,5 @@
 async function craftItem(bot, name, count = 1) {
+    checkCancelled();
     // Validate inputs
     if (typeof name !== "string") {
         throw new Error("name for craftItem must be a string");
@@ -26,6 +27,7 @@ async function craftItem(bot, name, count = 1) {
         await bot.pathfinder.goto(
             new GoalLookAtBlock(craftingTable.position, bot.world)
         );
+        checkCancelled();
     }
 
     // Fetch the recipe
@@ -7,6 +7,7 @@ async function exploreUntil(
         return false;
     }
 ) {
+    checkCancelled();
     if (typeof maxTime !== "number") {
         throw new Error("maxTime must be a number");
     }
@@ -64,6 +65,7 @@ async function exploreUntil(
             bot.pathfinder.setGoal(goal);
 
             try {
+                checkCancelled();
                 const result = callback();
                 if (result) {
                     cleanUp();
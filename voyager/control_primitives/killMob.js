@@ -1,4 +1,5 @@
 async function killMob(bot, mobName, timeout = 300) {
+    checkCancelled();
     // return if mobName is not string
     if (typeof mobName !== "string") {
         throw new Error(`mobName for killMob must be a string`);
@@ -44,6 +45,7 @@ async function killMob(bot, mobName, timeout = 300) {
         await bot.pvp.attack(entity);
         droppedItem = await waitForMobRemoved(bot, entity, timeout);
     }
+    checkCancelled();
     if (droppedItem) {
         await bot.collectBlock.collect(droppedItem, { ignoreNoPath: true });
     }
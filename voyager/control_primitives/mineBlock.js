@@ -1,4 +1,5 @@
 async function mineBlock(bot, name, count = 1) {
+    checkCancelled();
     // return if name is not string
     if (typeof name !== "string") {
         throw new Error(`name for mineBlock must be a string`);
@@ -33,5 +34,6 @@ async function mineBlock(bot, name, count = 1) {
         ignoreNoPath: true,
         count: count,
     });
+    checkCancelled();
     bot.save(`${name}_mined`);
 }
@@ -1,18 +1,24 @@
-import pkg_resources
+import functools
 import os
+
 import voyager.utils as U
 
 
+@functools.lru_cache(maxsize=None)
+def _list_primitive_names(package_path):
+    return [
+        primitive[:-3]
+        for primitive in sorted(os.listdir(package_path))
+        if primitive.endswith(".js")
+    ]
+
+
 def load_control_primitives_context(primitive_names=None):
-    package_path = pkg_resources.resource_filename("voyager", "")
+    package_path = os.path.dirname(os.path.abspath(__file__))
     if primitive_names is None:
-        primitive_names = [
-            primitive[:-3]
-            for primitive in os.listdir(f"{package_path}/control_primitives_context")
-            if primitive.endswith(".js")
-        ]
+        primitive_names = _list_primitive_names(package_path)
     primitives = [
-        U.load_text(f"{package_path}/control_primitives_context/{primitive_name}.js")
+        U.load_text_cached(f"{package_path}/{primitive_name}.js")
         for primitive_name in primitive_names
     ]
     return primitives
@@ -1 +1,10 @@
-from .bridge import VoyagerEnv
+__all__ = ["VoyagerEnv"]
+
+
+def __getattr__(name):
+    # the env pulls in gymnasium and requests, import it on first use
+    if name == "VoyagerEnv":
+        from .bridge import VoyagerEnv
+
+        return VoyagerEnv
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,69 @@
+"""
+Policies that end a streamed step early.
+
+While a step runs in stream mode, mineflayer pushes one message per event,
+{"type": "event", "event": [event_type, event]}, and {"type": "stuck"} every
+time stuck detection had to teleport the bot. A policy is called with each
+message and returns the reason to abort the step, or None to let it run.
+"""
+
+
+class AbortPolicy:
+    def reset(self):
+        """
+        Called before each step.
+        """
+
+    def __call__(self, message):
+        raise NotImplementedError
+
+
+class AbortOnError(AbortPolicy):
+    """
+    Abort on the first onError event.
+    """
+
+    def __call__(self, message):
+        if message["type"] == "event" and message["event"][0] == "onError":
+            return f"error: {message['event'][1]['onError']}"
+        return None
+
+
+class AbortWhenStuck(AbortPolicy):
+    """
+    Abort once the bot got stuck `max_stuck` times in the same step.
+    """
+
+    def __init__(self, max_stuck=1):
+        self.max_stuck = max_stuck
+        self.num_stuck = 0
+
+    def reset(self):
+        self.num_stuck = 0
+
+    def __call__(self, message):
+        if message["type"] == "stuck":
+            self.num_stuck += 1
+            if self.num_stuck >= self.max_stuck:
+                return f"stuck {self.num_stuck} times"
+        return None
+
+
+class AnyOf(AbortPolicy):
+    """
+    Abort as soon as one of `policies` does.
+    """
+
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def reset(self):
+        for policy in self.policies:
+            policy.reset()
+
+    def __call__(self, message):
+        for policy in self.policies:
+            reason = policy(message)
+            if reason:
+                return reason
+        return None
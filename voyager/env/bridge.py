@@ -12,6 +12,8 @@ from gymnasium.core import ObsType
 import voyager.utils as U
 
 from .minecraft_launcher import MinecraftInstance
+from .abort_policies import AbortPolicy
+from .observation import DeltaObservationReconstructor, iter_events
 from .process_monitor import SubprocessMonitor
 
 
@@ -24,6 +26,10 @@ class VoyagerEnv(gym.Env):
         server_port=3000,
         request_timeout=1,
         log_path="./logs",
+        delta_observations=False,
+        reuse_bot=True,
+        observation_limits=None,
+        step_timeout=None,
     ):
         if not mc_port and not azure_login:
             raise ValueError("Either mc_port or azure_login must be specified")
@@ -35,6 +41,11 @@ class VoyagerEnv(gym.Env):
         self.server_port = server_port
         self.request_timeout = request_timeout
         self.log_path = log_path
+        self.delta_observations = delta_observations
+        self.reuse_bot = reuse_bot
+        self.observation_limits = observation_limits or {}
+        # leave the server time to return a timed out step before the request gives up
+        self.step_timeout = step_timeout if step_timeout is not None else int(request_timeout * 0.9)
         self.mineflayer = self.get_mineflayer_process(server_port)
         if azure_login:
             self.mc_instance = self.get_mc_instance()
@@ -102,6 +113,20 @@ class VoyagerEnv(gym.Env):
         print("Failed to receive a valid response after several attempts.")
         return None
 
+    def is_healthy(self):
+        """
+        Returns: True if mineflayer is running and its bot is connected and not executing a step
+        """
+        if self.mc_instance and not self.mc_instance.is_running():
+            return False
+        if not self.mineflayer.is_running():
+            return False
+        try:
+            health = requests.post(f"{self.server}/health", timeout=5).json()
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+        return health["alive"] and not health["stepInProgress"]
+
     def check_process(self):
         if self.mc_instance and not self.mc_instance.is_running():
             self.start_mc_instance()
@@ -143,20 +168,111 @@ class VoyagerEnv(gym.Env):
             print(f"Server start failed. Error: {str(e)}")
         raise RuntimeError("Failed to start server via /start endpoint")
 
-    def step(self, code: str, programs: str = "",) -> Tuple[ObsType, SupportsFloat, bool, bool, Dict[str, Any]]:
+    def step(
+        self, code: str, programs: str = "", wait_mode: str = None, abort_policy: AbortPolicy = None
+    ) -> Tuple[ObsType, SupportsFloat, bool, bool, Dict[str, Any]]:
+        """
+        Args:
+            wait_mode (str, optional): "fixed" to pad the step with wait_ticks before and after running the code,
+                "adaptive" to only wait for pending command acknowledgements, capped at wait_ticks.
+                Defaults to the mode given to reset.
+            abort_policy (AbortPolicy, optional): stream the events of the step while the code runs and abort it
+                on the server as soon as the policy returns a reason, see voyager.env.abort_policies.
+        """
         if not self.has_reset:
             raise RuntimeError("Environment has not been reset yet")
-        self.check_process()
+        if not self.reset_options.get("reuse"):
+            self.check_process()
+        elif not self.is_healthy():
+            # a reused bot is only restarted when the health probe fails
+            self.check_process()
         data = {
             "code": code,
             "programs": programs,
         }
-        result = self.send_request(f"{self.server}/step", json_data=data)
-
-        if result.status_code != 200:
+        if wait_mode:
+            data["waitMode"] = wait_mode
+        if abort_policy:
+            return self.parse_events(self.stream_step(data, abort_policy))
+        # never resend a step, the program may still be running in the bot
+        result = self.send_request(f"{self.server}/step", json_data=data, max_retries=1)
+
+        if result is None or result.status_code != 200:
             raise RuntimeError("Failed to step Minecraft server")
         returned_data = result.json()
-        return json.loads(returned_data)
+        return self.parse_events(returned_data)
+
+    def stream_step(self, data, abort_policy):
+        """
+        Run a step in stream mode, passing each pushed message to abort_policy.
+
+        Returns: the events of the whole step. The last message lists them,
+        with the events that were already streamed given by their position.
+        """
+        abort_policy.reset()
+        aborted = False
+        streamed = []
+        with requests.post(
+            f"{self.server}/step",
+            json={**data, "stream": True},
+            timeout=self.request_timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["type"] == "result":
+                    return [
+                        streamed[event] if isinstance(event, int) else event
+                        for event in message["events"]
+                    ]
+                if message["type"] == "event":
+                    streamed.append(message["event"])
+                if aborted:
+                    continue
+                reason = abort_policy(message)
+                if reason:
+                    aborted = True
+                    print(f"\033[33mAborting step: {reason}\033[0m")
+                    self.send_request(f"{self.server}/abort", json_data={"reason": reason}, timeout=5)
+        raise RuntimeError("Step stream ended without the step result")
+
+    def parse_events(self, returned_data):
+        """
+        :param returned_data: the JSON payload of a /step response, or its
+        events already decoded from a stream
+        """
+        if isinstance(returned_data, str):
+            if not self.reset_options.get("deltaObs"):
+                return json.loads(returned_data)
+            returned_data = iter_events(returned_data)
+        elif not self.reset_options.get("deltaObs"):
+            return returned_data
+        reconstructor = DeltaObservationReconstructor()
+        return [reconstructor.feed(*event) for event in returned_data]
+
+    def get_observation_limits(self, limits):
+        """
+        Caps on what mineflayer keeps per step and per bot:
+        max_events: events returned by one step, older ones are folded into a
+            `truncated` marker event at the front
+        max_block_records: block names kept in blockRecords, least recently seen
+            are evicted first
+        max_chests: chests kept in nearbyChests, least recently touched are
+            evicted first
+        Limits that are not given use the mineflayer defaults.
+        """
+        names = {
+            "max_events": "maxEvents",
+            "max_block_records": "maxBlockRecords",
+            "max_chests": "maxChests",
+        }
+        for name in limits:
+            if name not in names:
+                raise ValueError(f"Unknown observation limit: {name}")
+        return {names[name]: value for name, value in limits.items()}
 
     def render(self):
         raise NotImplementedError("render is not implemented")
@@ -174,13 +290,23 @@ class VoyagerEnv(gym.Env):
             "equipment": options.get("equipment", []),
             "spread": options.get("spread", False),
             "waitTicks": options.get("wait_ticks", 5),
+            "waitMode": options.get("wait_mode", "fixed"),
             "position": options.get("position", None),
+            "deltaObs": options.get("delta_observations", self.delta_observations),
+            "reuse": options.get("reuse", self.reuse_bot),
+            "stepTimeout": options.get("step_timeout", self.step_timeout),
+            "limits": self.get_observation_limits(
+                options.get("observation_limits", self.observation_limits)
+            ),
         }
 
-        self.mineflayer.stop()
-        time.sleep(1)  # wait for mineflayer to exit
-
-        returned_data = self.check_process()
+        if self.reset_options["reuse"] and self.is_healthy():
+            # keep the node process and the connected bot, only reset the episode
+            returned_data = self.try_server_start_endpoint()
+        else:
+            self.mineflayer.stop()
+            time.sleep(1)  # wait for mineflayer to exit
+            returned_data = self.check_process()
         if not returned_data:
             raise RuntimeError("Failed to reset environment due to server issues.")
 
@@ -4,7 +4,13 @@ const bodyParser = require("body-parser");
 const mineflayer = require("mineflayer");
 
 const skills = require("./lib/skillLoader");
-const { initCounter, getNextTime } = require("./lib/utils");
+const {
+    initCounter,
+    getNextTime,
+    initAckTracker,
+    waitForSettle,
+} = require("./lib/utils");
+const { SpatialIndex } = require("./lib/spatialIndex");
 const obs = require("./lib/observation/base");
 const OnChat = require("./lib/observation/onChat");
 const OnError = require("./lib/observation/onError");
@@ -22,10 +28,20 @@ const app = express();
 app.use(bodyParser.json({ limit: "50mb" }));
 app.use(bodyParser.urlencoded({ limit: "50mb", extended: false }));
 
-app.post("/start", (req, res) => {
+app.post("/start", async (req, res) => {
+    console.log(req.body);
+    // Keep the connected bot and only reset the episode when it is healthy
+    // and not in the middle of a step
+    if (req.body.reuse && bot && bot.entity && !bot.stepInProgress) {
+        applyStartOptions(bot, req.body);
+        stopActions(bot);
+        resetEpisode(bot);
+        await resetBot(bot, req.body);
+        res.json(bot.observe());
+        return;
+    }
     if (bot) onDisconnect("Restarting bot");
     bot = null;
-    console.log(req.body);
     bot = mineflayer.createBot({
         host: "localhost", // minecraft server ip
         port: req.body.port, // minecraft server port
@@ -37,11 +53,10 @@ app.post("/start", (req, res) => {
     bot.once("error", onConnectionFailed);
 
     // Event subscriptions
-    bot.waitTicks = req.body.waitTicks;
+    applyStartOptions(bot, req.body);
     bot.globalTickCounter = 0;
     bot.stuckTickCounter = 0;
     bot.stuckPosList = [];
-    bot.iron_pickaxe = false;
 
     bot.on("kicked", onDisconnect);
 
@@ -52,49 +67,7 @@ app.post("/start", (req, res) => {
 
     bot.once("spawn", async () => {
         bot.removeListener("error", onConnectionFailed);
-        let itemTicks = 1;
-        if (req.body.reset === "hard") {
-            bot.chat("/clear @s");
-            bot.chat("/kill @s");
-            const inventory = req.body.inventory ? req.body.inventory : {};
-            const equipment = req.body.equipment
-                ? req.body.equipment
-                : [null, null, null, null, null, null];
-            for (let key in inventory) {
-                bot.chat(`/give @s minecraft:${key} ${inventory[key]}`);
-                itemTicks += 1;
-            }
-            const equipmentNames = [
-                "armor.head",
-                "armor.chest",
-                "armor.legs",
-                "armor.feet",
-                "weapon.mainhand",
-                "weapon.offhand",
-            ];
-            for (let i = 0; i < 6; i++) {
-                if (i === 4) continue;
-                if (equipment[i]) {
-                    bot.chat(
-                        `/item replace entity @s ${equipmentNames[i]} with minecraft:${equipment[i]}`
-                    );
-                    itemTicks += 1;
-                }
-            }
-        }
-
-        if (req.body.position) {
-            bot.chat(
-                `/tp @s ${req.body.position.x} ${req.body.position.y} ${req.body.position.z}`
-            );
-        }
-
-        // if iron_pickaxe is in bot's inventory
-        if (
-            bot.inventory.items().find((item) => item.name === "iron_pickaxe")
-        ) {
-            bot.iron_pickaxe = true;
-        }
+        initAckTracker(bot);
 
         const { pathfinder } = require("mineflayer-pathfinder");
         const tool = require("mineflayer-tool").plugin;
@@ -111,6 +84,7 @@ app.post("/start", (req, res) => {
         // bot.collectBlock.movements.digCost = 0;
         // bot.collectBlock.movements.placeCost = 0;
 
+        bot.spatialIndex = new SpatialIndex(bot);
         obs.inject(bot, [
             OnChat,
             OnError,
@@ -122,13 +96,9 @@ app.post("/start", (req, res) => {
             BlockRecords,
         ]);
         skills.inject(bot);
+        initStepContext(bot);
 
-        if (req.body.spread) {
-            bot.chat(`/spreadplayers ~ ~ 0 300 under 80 false @s`);
-            await bot.waitForTicks(bot.waitTicks);
-        }
-
-        await bot.waitForTicks(bot.waitTicks * itemTicks);
+        await resetBot(bot, req.body);
         res.json(bot.observe());
 
         initCounter(bot);
@@ -141,14 +111,225 @@ app.post("/start", (req, res) => {
         bot = null;
         res.status(400).json({ error: e });
     }
-    function onDisconnect(message) {
-        if (bot.viewer) {
-            bot.viewer.close();
+});
+
+function onDisconnect(message) {
+    if (bot.viewer) {
+        bot.viewer.close();
+    }
+    bot.end();
+    console.log(message);
+    bot = null;
+}
+
+function applyStartOptions(bot, body) {
+    bot.waitTicks = body.waitTicks;
+    bot.waitMode = body.waitMode || "fixed";
+    bot.deltaObs = !!body.deltaObs;
+    bot.stepTimeout = body.stepTimeout || 0;
+    const limits = body.limits || {};
+    bot.maxEvents = limits.maxEvents || 1000;
+    bot.maxBlockRecords = limits.maxBlockRecords || 512;
+    bot.maxChests = limits.maxChests || 64;
+}
+
+// Stop whatever the bot was doing when the last episode ended
+function stopActions(bot) {
+    bot.pathfinder.setGoal(null);
+    bot.pvp.stop();
+    bot.hawkEye.stop();
+    bot.clearControlStates();
+}
+
+// Clear per-episode state of a bot that is kept across resets
+function resetEpisode(bot) {
+    bot.cumulativeObs = [];
+    bot.evictions = {};
+    bot.lastObs = {};
+    bot.obsList.forEach((obs) => obs.reset());
+    bot.globalTickCounter = 0;
+    bot.stuckTickCounter = 0;
+    bot.stuckPosList = [];
+}
+
+// Apply inventory, equipment and position of the reset options in place
+async function resetBot(bot, body) {
+    let itemTicks = 1;
+    if (body.reset === "hard") {
+        bot.chat("/clear @s");
+        bot.chat("/kill @s");
+        const inventory = body.inventory ? body.inventory : {};
+        const equipment = body.equipment
+            ? body.equipment
+            : [null, null, null, null, null, null];
+        for (let key in inventory) {
+            bot.chat(`/give @s minecraft:${key} ${inventory[key]}`);
+            itemTicks += 1;
         }
-        bot.end();
-        console.log(message);
-        bot = null;
+        const equipmentNames = [
+            "armor.head",
+            "armor.chest",
+            "armor.legs",
+            "armor.feet",
+            "weapon.mainhand",
+            "weapon.offhand",
+        ];
+        for (let i = 0; i < 6; i++) {
+            if (i === 4) continue;
+            if (equipment[i]) {
+                bot.chat(
+                    `/item replace entity @s ${equipmentNames[i]} with minecraft:${equipment[i]}`
+                );
+                itemTicks += 1;
+            }
+        }
+    }
+
+    if (body.position) {
+        bot.chat(
+            `/tp @s ${body.position.x} ${body.position.y} ${body.position.z}`
+        );
+    }
+
+    // if iron_pickaxe is in bot's inventory
+    bot.iron_pickaxe = !!bot.inventory
+        .items()
+        .find((item) => item.name === "iron_pickaxe");
+
+    if (body.spread) {
+        bot.chat(`/spreadplayers ~ ~ 0 300 under 80 false @s`);
+        await waitForSettle(bot, bot.waitTicks, bot.waitMode);
     }
+
+    await waitForSettle(bot, bot.waitTicks * itemTicks, bot.waitMode);
+}
+
+// minecraft-data with the item and block aliases used by the prompts,
+// built once per version
+const mcDataCache = {};
+function getMcData(version) {
+    if (!mcDataCache[version]) {
+        const mcData = require("minecraft-data")(version);
+        mcData.itemsByName["leather_cap"] = mcData.itemsByName["leather_helmet"];
+        mcData.itemsByName["leather_tunic"] =
+            mcData.itemsByName["leather_chestplate"];
+        mcData.itemsByName["leather_pants"] =
+            mcData.itemsByName["leather_leggings"];
+        mcData.itemsByName["leather_boots"] =
+            mcData.itemsByName["leather_boots"];
+        mcData.itemsByName["lapis_lazuli_ore"] =
+            mcData.itemsByName["lapis_ore"];
+        mcData.blocksByName["lapis_lazuli_ore"] =
+            mcData.blocksByName["lapis_ore"];
+        mcDataCache[version] = mcData;
+    }
+    return mcDataCache[version];
+}
+
+// Build what every step needs once per bot instead of once per step
+function initStepContext(bot) {
+    const { Movements } = require("mineflayer-pathfinder");
+    bot.mcData = getMcData(bot.version);
+    bot.movements = new Movements(bot, bot.mcData);
+    // programs may tweak the shared movements, remember the defaults so that
+    // each step starts from them
+    bot.movementsDefaults = {};
+    for (const [key, value] of Object.entries(bot.movements)) {
+        if (value instanceof Set) {
+            bot.movementsDefaults[key] = new Set(value);
+        } else if (Array.isArray(value)) {
+            bot.movementsDefaults[key] = value.slice();
+        } else if (value === null || typeof value !== "object") {
+            bot.movementsDefaults[key] = value;
+        }
+    }
+    bot.stepInProgress = false;
+    bot.on("physicsTick", () => onTick(bot));
+}
+
+function resetMovements(bot) {
+    for (const [key, value] of Object.entries(bot.movementsDefaults)) {
+        if (value instanceof Set) {
+            bot.movements[key] = new Set(value);
+        } else if (Array.isArray(value)) {
+            bot.movements[key] = value.slice();
+        } else {
+            bot.movements[key] = value;
+        }
+    }
+    bot.pathfinder.setMovements(bot.movements);
+}
+
+function onTick(bot) {
+    if (!bot.stepInProgress) return;
+    bot.globalTickCounter++;
+    if (bot.pathfinder.isMoving()) {
+        bot.stuckTickCounter++;
+        if (bot.stuckTickCounter >= 100) {
+            onStuck(bot, 1.5);
+            bot.stuckTickCounter = 0;
+        }
+    }
+}
+
+function onStuck(bot, posThreshold) {
+    const currentPos = bot.entity.position;
+    bot.stuckPosList.push(currentPos);
+
+    // Check if the list is full
+    if (bot.stuckPosList.length === 5) {
+        const oldestPos = bot.stuckPosList[0];
+        const posDifference = currentPos.distanceTo(oldestPos);
+
+        if (posDifference < posThreshold) {
+            bot.emit("stuck");
+            teleportBot(bot); // execute the function
+        }
+
+        // Remove the oldest time from the list
+        bot.stuckPosList.shift();
+    }
+}
+
+function teleportBot(bot) {
+    const blocks = bot.findBlocks({
+        matching: (block) => {
+            return block.type === 0;
+        },
+        maxDistance: 1,
+        count: 27,
+    });
+
+    if (blocks) {
+        // console.log(blocks.length);
+        const randomIndex = Math.floor(Math.random() * blocks.length);
+        const block = blocks[randomIndex];
+        bot.chat(`/tp @s ${block.x} ${block.y} ${block.z}`);
+    } else {
+        bot.chat("/tp @s ~ ~1.25 ~");
+    }
+}
+
+// Uncaught errors are routed to the step that is currently running
+let onUncaughtException = null;
+// Ends the step that is currently running early, set by /step
+let abortStep = null;
+process.on("uncaughtException", (err) => {
+    if (!onUncaughtException) throw err;
+    onUncaughtException(err);
+});
+
+app.post("/health", (req, res) => {
+    res.json({
+        alive: !!(bot && bot.entity),
+        stepInProgress: !!(bot && bot.stepInProgress),
+    });
+});
+
+app.post("/abort", (req, res) => {
+    const running = !!abortStep;
+    if (running) abortStep(`Step aborted: ${req.body.reason || "requested"}`);
+    res.json({ aborted: running });
 });
 
 app.post("/step", async (req, res) => {
@@ -157,25 +338,74 @@ app.post("/step", async (req, res) => {
     function otherError(err) {
         console.log("Uncaught Error");
         bot.emit("error", handleError(err));
-        bot.waitForTicks(bot.waitTicks).then(() => {
-            if (!response_sent) {
-                response_sent = true;
-                res.json(bot.observe());
-            }
-        });
+        bot.waitForTicks(bot.waitTicks).then(sendResult);
+    }
+
+    // In stream mode every event is written as a line of JSON while the code
+    // runs, followed by a last line with the events of the whole step. In
+    // that line, events that were already streamed are only sent as their
+    // position in the stream.
+    const stream = !!req.body.stream;
+    const streamed = new Map();
+    function writeMessage(message) {
+        res.write(JSON.stringify(message) + "\n");
+    }
+    function onEventPushed(event_name, event) {
+        streamed.set(event, streamed.size);
+        writeMessage({ type: "event", event: [event_name, event] });
+    }
+    function onStuckSignal() {
+        writeMessage({ type: "stuck" });
+    }
+    if (stream) {
+        res.setHeader("Content-Type", "application/x-ndjson");
+        bot.onEventPushed = onEventPushed;
+        bot.on("stuck", onStuckSignal);
+    }
+
+    function sendResult() {
+        if (response_sent) return;
+        response_sent = true;
+        if (stream) {
+            bot.onEventPushed = null;
+            bot.removeListener("stuck", onStuckSignal);
+            const events = bot
+                .takeObservations()
+                .map(([event_name, event]) =>
+                    streamed.has(event)
+                        ? streamed.get(event)
+                        : [event_name, event]
+                );
+            res.end(JSON.stringify({ type: "result", events }) + "\n");
+        } else {
+            res.json(bot.observe());
+        }
     }
 
-    process.on("uncaughtException", otherError);
-
-    const mcData = require("minecraft-data")(bot.version);
-    mcData.itemsByName["leather_cap"] = mcData.itemsByName["leather_helmet"];
-    mcData.itemsByName["leather_tunic"] =
-        mcData.itemsByName["leather_chestplate"];
-    mcData.itemsByName["leather_pants"] =
-        mcData.itemsByName["leather_leggings"];
-    mcData.itemsByName["leather_boots"] = mcData.itemsByName["leather_boots"];
-    mcData.itemsByName["lapis_lazuli_ore"] = mcData.itemsByName["lapis_ore"];
-    mcData.blocksByName["lapis_lazuli_ore"] = mcData.blocksByName["lapis_ore"];
+    // Aborting ends the step right away. The program itself is stopped
+    // cooperatively: control primitives call checkCancelled, which throws in
+    // a program whose step was aborted, even after that step returned.
+    let _stepCancelled = null;
+    function stepCancelled() {
+        return _stepCancelled !== null;
+    }
+    function checkCancelled() {
+        if (_stepCancelled !== null) throw new Error(_stepCancelled);
+    }
+    bot.stepAborted = false;
+    const aborted = new Promise((resolve) => {
+        abortStep = (message) => {
+            abortStep = null;
+            _stepCancelled = message;
+            bot.stepAborted = true;
+            stopActions(bot);
+            resolve(new Error(message));
+        };
+    });
+
+    onUncaughtException = otherError;
+
+    const mcData = bot.mcData;
     const {
         Movements,
         goals: {
@@ -206,26 +436,13 @@ app.post("/step", async (req, res) => {
     const { Vec3 } = require("vec3");
 
     // Set up pathfinder
-    const movements = new Movements(bot, mcData);
-    bot.pathfinder.setMovements(movements);
+    resetMovements(bot);
+    const movements = bot.movements;
 
     bot.globalTickCounter = 0;
     bot.stuckTickCounter = 0;
     bot.stuckPosList = [];
 
-    function onTick() {
-        bot.globalTickCounter++;
-        if (bot.pathfinder.isMoving()) {
-            bot.stuckTickCounter++;
-            if (bot.stuckTickCounter >= 100) {
-                onStuck(1.5);
-                bot.stuckTickCounter = 0;
-            }
-        }
-    }
-
-    bot.on("physicsTick", onTick);
-
     // initialize fail count
     let _craftItemFailCount = 0;
     let _killMobFailCount = 0;
@@ -236,21 +453,34 @@ app.post("/step", async (req, res) => {
     // Retrieve array form post bod
     const code = req.body.code;
     const programs = req.body.programs;
+    const waitMode = req.body.waitMode || bot.waitMode;
+    // seconds the program may run, 0 for no limit
+    const timeout = req.body.timeout || bot.stepTimeout;
     bot.cumulativeObs = [];
-    await bot.waitForTicks(bot.waitTicks);
-    const r = await evaluateCode(code, programs);
-    process.off("uncaughtException", otherError);
+    bot.stepInProgress = true;
+    await waitForSettle(bot, bot.waitTicks, waitMode);
+    const timeoutId = timeout
+        ? setTimeout(() => {
+              if (abortStep) {
+                  abortStep(`Execution timed out after ${timeout} seconds`);
+              }
+          }, timeout * 1000)
+        : null;
+    const r = bot.stepAborted
+        ? await aborted
+        : await Promise.race([evaluateCode(code, programs), aborted]);
+    clearTimeout(timeoutId);
+    onUncaughtException = null;
     if (r !== "success") {
         bot.emit("error", handleError(r));
     }
     await returnItems();
     // wait for last message
-    await bot.waitForTicks(bot.waitTicks);
-    if (!response_sent) {
-        response_sent = true;
-        res.json(bot.observe());
-    }
-    bot.removeListener("physicsTick", onTick);
+    await waitForSettle(bot, bot.waitTicks, waitMode);
+    abortStep = null;
+    sendResult();
+    bot.stepInProgress = false;
+    bot.stepAborted = false;
 
     async function evaluateCode(code, programs) {
         // Echo the code produced for players to see it. Don't echo when the bot code is already producing dialog or it will double echo
@@ -262,62 +492,22 @@ app.post("/step", async (req, res) => {
         }
     }
 
-    function onStuck(posThreshold) {
-        const currentPos = bot.entity.position;
-        bot.stuckPosList.push(currentPos);
-
-        // Check if the list is full
-        if (bot.stuckPosList.length === 5) {
-            const oldestPos = bot.stuckPosList[0];
-            const posDifference = currentPos.distanceTo(oldestPos);
-
-            if (posDifference < posThreshold) {
-                teleportBot(); // execute the function
-            }
-
-            // Remove the oldest time from the list
-            bot.stuckPosList.shift();
-        }
-    }
-
-    function teleportBot() {
-        const blocks = bot.findBlocks({
-            matching: (block) => {
-                return block.type === 0;
-            },
-            maxDistance: 1,
-            count: 27,
-        });
-
-        if (blocks) {
-            // console.log(blocks.length);
-            const randomIndex = Math.floor(Math.random() * blocks.length);
-            const block = blocks[randomIndex];
-            bot.chat(`/tp @s ${block.x} ${block.y} ${block.z}`);
-        } else {
-            bot.chat("/tp @s ~ ~1.25 ~");
-        }
-    }
-
     function returnItems() {
         bot.chat("/gamerule doTileDrops false");
-        const crafting_table = bot.findBlock({
-            matching: mcData.blocksByName.crafting_table.id,
-            maxDistance: 128,
-        });
+        const crafting_table = bot.spatialIndex.nearestBlock(
+            "crafting_table",
+            128
+        );
         if (crafting_table) {
             bot.chat(
-                `/setblock ${crafting_table.position.x} ${crafting_table.position.y} ${crafting_table.position.z} air destroy`
+                `/setblock ${crafting_table.x} ${crafting_table.y} ${crafting_table.z} air destroy`
             );
             bot.chat("/give @s crafting_table");
         }
-        const furnace = bot.findBlock({
-            matching: mcData.blocksByName.furnace.id,
-            maxDistance: 128,
-        });
+        const furnace = bot.spatialIndex.nearestBlock("furnace", 128);
         if (furnace) {
             bot.chat(
-                `/setblock ${furnace.position.x} ${furnace.position.y} ${furnace.position.z} air destroy`
+                `/setblock ${furnace.x} ${furnace.y} ${furnace.z} air destroy`
             );
             bot.chat("/give @s furnace");
         }
@@ -8,6 +8,8 @@ class Observation {
 
         this.bot = bot;
         this.name = "Observation";
+        // only observed for full events when delta observations are enabled
+        this.fullOnly = false;
     }
 
     observe() {
@@ -20,26 +22,98 @@ class Observation {
 function inject(bot, obs_list) {
     bot.obsList = [];
     bot.cumulativeObs = [];
+    bot.evictions = {};
     bot.eventMemory = {};
     obs_list.forEach((obs) => {
         bot.obsList.push(new obs(bot));
     });
+    bot.lastObs = {};
     bot.event = function (event_name) {
+        // In delta mode only the first event of a step and the final observe
+        // event carry the full observation. Events in between skip the
+        // expensive world scans and only carry observations that changed.
+        const full =
+            !bot.deltaObs ||
+            event_name === "observe" ||
+            bot.cumulativeObs.length === 0;
         let result = {};
         bot.obsList.forEach((obs) => {
-            if (obs.name.startsWith("on") && obs.name !== event_name) {
+            if (obs.name.startsWith("on")) {
+                if (obs.name === event_name) result[obs.name] = obs.observe();
                 return;
             }
-            result[obs.name] = obs.observe();
+            if (!full && obs.fullOnly) {
+                return;
+            }
+            const value = obs.observe();
+            if (bot.deltaObs) {
+                const serialized = JSON.stringify(value);
+                if (!full && bot.lastObs[obs.name] === serialized) {
+                    return;
+                }
+                bot.lastObs[obs.name] = serialized;
+            }
+            result[obs.name] = value;
         });
+        if (!full) {
+            result.isDelta = true;
+        }
         bot.cumulativeObs.push([event_name, result]);
+        if (bot.onEventPushed) bot.onEventPushed(event_name, result);
+        const limit =
+            bot.maxEvents + (bot.cumulativeObs[0][0] === "truncated" ? 1 : 0);
+        if (bot.maxEvents && bot.cumulativeObs.length > limit) {
+            // drop the oldest event but the final observe is always kept
+            const marker = getTruncationMarker(bot);
+            const [droppedName, dropped] = bot.cumulativeObs.splice(1, 1)[0];
+            foldEvent(marker, dropped);
+            const truncated = marker.truncated;
+            truncated.events++;
+            truncated.eventTypes[droppedName] =
+                (truncated.eventTypes[droppedName] || 0) + 1;
+        }
     };
-    bot.observe = function () {
+    // the events of the step, ending with a final observe event
+    bot.takeObservations = function () {
         bot.event("observe");
+        if (Object.keys(bot.evictions).length) {
+            getTruncationMarker(bot).truncated.evicted = bot.evictions;
+            bot.evictions = {};
+        }
         const result = bot.cumulativeObs;
         bot.cumulativeObs = [];
-        return JSON.stringify(result);
+        return result;
+    };
+    bot.observe = function () {
+        return JSON.stringify(bot.takeObservations());
     };
 }
 
-module.exports = { Observation, inject };
+// The truncation marker is the first event of a step whose events or
+// observations were cut to stay within the configured limits. It carries the
+// observations of the events it replaces, so it reads like a full event, and
+// a `truncated` entry with the number of events dropped per type and the
+// number of entries evicted per observation.
+function getTruncationMarker(bot) {
+    const first = bot.cumulativeObs[0];
+    if (first[0] === "truncated") return first[1];
+    const marker = { truncated: { events: 0, eventTypes: {} } };
+    foldEvent(marker, first[1]);
+    bot.cumulativeObs.unshift(["truncated", marker]);
+    return marker;
+}
+
+function foldEvent(marker, event) {
+    for (const [name, value] of Object.entries(event)) {
+        if (name.startsWith("on") || name === "isDelta") continue;
+        marker[name] = value;
+    }
+}
+
+// Count entries an observation dropped to stay within its limit, reported
+// with the next observe
+function recordEviction(bot, name, count = 1) {
+    bot.evictions[name] = (bot.evictions[name] || 0) + count;
+}
+
+module.exports = { Observation, inject, recordEviction };
@@ -1,31 +1,46 @@
-const { Observation } = require("./base");
+const { Observation, recordEviction } = require("./base");
 
 class Chests extends Observation {
     constructor(bot) {
         super(bot);
         this.name = "nearbyChests";
+        // world scan, skipped by intermediate events in delta mode
+        this.fullOnly = true;
         this.chestsItems = {};
+        // least recently touched first, capped at bot.maxChests
         bot.on("closeChest", (chestItems, position) => {
-            this.chestsItems[position] = chestItems;
+            this.setChest(position, chestItems);
         });
         bot.on("removeChest", (chestPosition) => {
-            this.chestsItems[chestPosition] = "Invalid";
+            this.setChest(chestPosition, "Invalid");
         });
     }
 
     observe() {
-        const chests = this.bot.findBlocks({
-            matching: this.bot.registry.blocksByName.chest.id,
-            maxDistance: 16,
-            count: 999,
-        });
+        const chests = this.bot.spatialIndex.blocksWithin("chest", 16);
         chests.forEach((chest) => {
             if (!this.chestsItems.hasOwnProperty(chest)) {
-                this.chestsItems[chest] = "Unknown";
+                this.setChest(chest, "Unknown");
             }
         });
         return this.chestsItems;
     }
+
+    setChest(position, items) {
+        delete this.chestsItems[position];
+        this.chestsItems[position] = items;
+        const limit = this.bot.maxChests;
+        if (!limit) return;
+        const positions = Object.keys(this.chestsItems);
+        for (let i = 0; i < positions.length - limit; i++) {
+            delete this.chestsItems[positions[i]];
+            recordEviction(this.bot, this.name);
+        }
+    }
+
+    reset() {
+        this.chestsItems = {};
+    }
 }
 
 module.exports = Chests;
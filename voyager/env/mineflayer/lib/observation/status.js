@@ -73,29 +73,22 @@ class Status extends Observation {
     }
 
     getEntities() {
-        const entities = this.bot.entities;
-        if (!entities) return {};
-        // keep all monsters in one list, keep other mobs in another list
+        if (!this.bot.entities) return {};
+        // nearest distance of each kind of mob within 32 blocks
         const mobs = {};
-        for (const id in entities) {
-            const entity = entities[id];
-            if (!entity.displayName) continue;
-            if (entity.name === "player" || entity.name === "item") continue;
-            if (entity.position.distanceTo(this.bot.entity.position) < 32) {
-                if (!mobs[entity.name]) {
-                    mobs[entity.name] = entity.position.distanceTo(
-                        this.bot.entity.position
-                    );
-                } else if (
-                    mobs[entity.name] >
-                    entity.position.distanceTo(this.bot.entity.position)
-                ) {
-                    mobs[entity.name] = entity.position.distanceTo(
-                        this.bot.entity.position
-                    );
+        this.bot.spatialIndex
+            .entitiesWithin(
+                32,
+                (entity) =>
+                    entity.displayName &&
+                    entity.name !== "player" &&
+                    entity.name !== "item"
+            )
+            .forEach(([entity, distance]) => {
+                if (!mobs[entity.name] || mobs[entity.name] > distance) {
+                    mobs[entity.name] = distance;
                 }
-            }
-        }
+            });
         return mobs;
     }
 }
@@ -1,14 +1,17 @@
 // Blocks = require("./blocks")
-const { Observation } = require("./base");
+const { Observation, recordEviction } = require("./base");
 
 class Voxels extends Observation {
     constructor(bot) {
         super(bot);
         this.name = "voxels";
+        // world scan, skipped by intermediate events in delta mode
+        this.fullOnly = true;
+        this.cache = getVoxelCache(bot);
     }
 
     observe() {
-        return Array.from(getSurroundingBlocks(this.bot, 8, 2, 8));
+        return this.cache.names();
     }
 }
 
@@ -16,20 +19,37 @@ class BlockRecords extends Observation {
     constructor(bot) {
         super(bot);
         this.name = "blockRecords";
+        // large and slow-changing, only sent with full events in delta mode
+        this.fullOnly = true;
+        // least recently seen first, capped at bot.maxBlockRecords
         this.records = new Set();
         this.tick = 0;
+        this.cache = getVoxelCache(bot);
         bot.on("physicsTick", () => {
             this.tick++;
             if (this.tick >= 100) {
                 const items = getInventoryItems(this.bot);
-                getSurroundingBlocks(this.bot, 8, 2, 8).forEach((block) => {
-                    if (!items.has(block)) this.records.add(block);
+                this.cache.names().forEach((block) => {
+                    if (items.has(block)) return;
+                    this.records.delete(block);
+                    this.records.add(block);
                 });
+                this.evict();
                 this.tick = 0;
             }
         });
     }
 
+    evict() {
+        const limit = this.bot.maxBlockRecords;
+        if (!limit) return;
+        for (const block of this.records) {
+            if (this.records.size <= limit) break;
+            this.records.delete(block);
+            recordEviction(this.bot, this.name);
+        }
+    }
+
     observe() {
         return Array.from(this.records);
     }
@@ -39,21 +59,146 @@ class BlockRecords extends Observation {
     }
 }
 
-function getSurroundingBlocks(bot, x_distance, y_distance, z_distance) {
-    const surroundingBlocks = new Set();
+// Names of the non-air blocks in a box around the bot, kept up to date from
+// block updates and bot movement. Only the slices that enter the box when the
+// bot moves are scanned; a full rescan happens when chunks load in the box or
+// the bot jumps far, and at most once every minFullScanTicks.
+class VoxelCache {
+    constructor(
+        bot,
+        xDistance = 8,
+        yDistance = 2,
+        zDistance = 8,
+        minFullScanTicks = 20
+    ) {
+        this.bot = bot;
+        this.xDistance = xDistance;
+        this.yDistance = yDistance;
+        this.zDistance = zDistance;
+        this.minFullScanTicks = minFullScanTicks;
+        this.center = null;
+        this.cells = new Map(); // "x,y,z" -> block name
+        this.counts = new Map(); // block name -> number of cells
+        this.dirty = true;
+        this.tick = 0;
+        this.lastFullScanTick = -Infinity;
+        bot.on("physicsTick", () => {
+            this.tick++;
+        });
+        bot.on("blockUpdate", (oldBlock, newBlock) => {
+            if (newBlock && this.inWindow(newBlock.position, this.center)) {
+                this.setCell(newBlock.position, newBlock);
+            }
+        });
+        bot.on("chunkColumnLoad", (corner) => {
+            if (!this.center) return;
+            if (
+                corner.x <= this.center.x + this.xDistance &&
+                corner.x + 16 > this.center.x - this.xDistance &&
+                corner.z <= this.center.z + this.zDistance &&
+                corner.z + 16 > this.center.z - this.zDistance
+            ) {
+                this.dirty = true;
+            }
+        });
+    }
+
+    names() {
+        this.refresh();
+        return Array.from(this.counts.keys());
+    }
+
+    refresh() {
+        const center = this.bot.entity.position.floored();
+        const canFullScan =
+            this.tick - this.lastFullScanTick >= this.minFullScanTicks;
+        if (!this.center || (this.dirty && canFullScan)) {
+            this.fullScan(center);
+        } else if (!center.equals(this.center)) {
+            if (
+                Math.abs(center.x - this.center.x) > 2 * this.xDistance ||
+                Math.abs(center.y - this.center.y) > 2 * this.yDistance ||
+                Math.abs(center.z - this.center.z) > 2 * this.zDistance
+            ) {
+                this.fullScan(center);
+            } else {
+                this.shift(center);
+            }
+        }
+    }
+
+    fullScan(center) {
+        this.cells = new Map();
+        this.counts = new Map();
+        this.center = center;
+        this.forEachInWindow(center, (position) => this.scanCell(position));
+        this.dirty = false;
+        this.lastFullScanTick = this.tick;
+    }
+
+    // Drop the cells that left the box and scan the ones that entered it
+    shift(center) {
+        const oldCenter = this.center;
+        for (const [key, name] of this.cells) {
+            const [x, y, z] = key.split(",").map(Number);
+            if (!this.inWindow({ x, y, z }, center)) {
+                this.cells.delete(key);
+                this.decrement(name);
+            }
+        }
+        this.center = center;
+        this.forEachInWindow(center, (position) => {
+            if (!this.inWindow(position, oldCenter)) this.scanCell(position);
+        });
+    }
+
+    scanCell(position) {
+        this.setCell(position, this.bot.blockAt(position));
+    }
+
+    setCell(position, block) {
+        const key = `${position.x},${position.y},${position.z}`;
+        const name = block && block.type !== 0 ? block.name : null;
+        const oldName = this.cells.get(key);
+        if (oldName === name) return;
+        if (oldName !== undefined) this.decrement(oldName);
+        if (name === null) {
+            this.cells.delete(key);
+        } else {
+            this.cells.set(key, name);
+            this.counts.set(name, (this.counts.get(name) || 0) + 1);
+        }
+    }
+
+    decrement(name) {
+        const count = this.counts.get(name) - 1;
+        if (count > 0) this.counts.set(name, count);
+        else this.counts.delete(name);
+    }
 
-    for (let x = -x_distance; x <= x_distance; x++) {
-        for (let y = -y_distance; y <= y_distance; y++) {
-            for (let z = -z_distance; z <= z_distance; z++) {
-                const block = bot.blockAt(bot.entity.position.offset(x, y, z));
-                if (block && block.type !== 0) {
-                    surroundingBlocks.add(block.name);
+    inWindow(position, center) {
+        return (
+            center !== null &&
+            Math.abs(position.x - center.x) <= this.xDistance &&
+            Math.abs(position.y - center.y) <= this.yDistance &&
+            Math.abs(position.z - center.z) <= this.zDistance
+        );
+    }
+
+    forEachInWindow(center, fn) {
+        for (let x = -this.xDistance; x <= this.xDistance; x++) {
+            for (let y = -this.yDistance; y <= this.yDistance; y++) {
+                for (let z = -this.zDistance; z <= this.zDistance; z++) {
+                    fn(center.offset(x, y, z));
                 }
             }
         }
     }
-    // console.log(surroundingBlocks);
-    return surroundingBlocks;
+}
+
+function getVoxelCache(bot) {
+    if (!bot.voxelCache) bot.voxelCache = new VoxelCache(bot, 8, 2, 8);
+    return bot.voxelCache;
 }
 
 function getInventoryItems(bot) {
@@ -64,4 +209,4 @@ function getInventoryItems(bot) {
     return items;
 }
 
-module.exports = { Voxels, BlockRecords };
+module.exports = { Voxels, BlockRecords, VoxelCache };
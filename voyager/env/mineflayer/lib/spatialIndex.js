@@ -0,0 +1,204 @@
+// Index of entities and container blocks around the bot, maintained from
+// world events so that observations do not have to scan every loaded entity
+// or chunk on each event.
+
+// width of a chunk column in blocks
+const CHUNK_SIZE = 16;
+// horizontal distance across a chunk column, rounded up. A column counts as
+// in range when any part of it is, so blocks at its far corner can be this
+// much further away than the range.
+const COLUMN_DIAGONAL = Math.ceil(CHUNK_SIZE * Math.SQRT2);
+
+class SpatialIndex {
+    constructor(
+        bot,
+        trackedBlocks = ["chest", "crafting_table", "furnace"],
+        cellSize = 16
+    ) {
+        this.bot = bot;
+        this.cellSize = cellSize;
+        // entity grid: "cx,cz" -> Set of entity ids
+        this.cells = new Map();
+        this.entityCells = new Map();
+        // block name -> Map of "x,y,z" -> position
+        this.blocks = new Map();
+        trackedBlocks.forEach((name) => this.blocks.set(name, new Map()));
+        // chunk columns loaded since the last scan for tracked blocks, blocks
+        // that were already in them do not show up as block updates
+        this.pendingColumns = new Map();
+        for (const { chunkX, chunkZ } of bot.world.getColumns()) {
+            this.addPendingColumn({ x: chunkX * CHUNK_SIZE, z: chunkZ * CHUNK_SIZE });
+        }
+
+        for (const id in bot.entities) {
+            this.updateEntity(bot.entities[id]);
+        }
+        bot.on("entitySpawn", (entity) => this.updateEntity(entity));
+        bot.on("entityMoved", (entity) => this.updateEntity(entity));
+        bot.on("entityGone", (entity) => this.removeEntity(entity));
+        bot.on("blockUpdate", (oldBlock, newBlock) => {
+            if (oldBlock) this.removeBlock(oldBlock.name, oldBlock.position);
+            if (newBlock) this.addBlock(newBlock.name, newBlock.position);
+        });
+        bot.on("chunkColumnLoad", (corner) => this.addPendingColumn(corner));
+        bot.on("chunkColumnUnload", (corner) => {
+            this.pendingColumns.delete(`${corner.x},${corner.z}`);
+            for (const positions of this.blocks.values()) {
+                for (const [key, position] of positions) {
+                    if (
+                        position.x >= corner.x &&
+                        position.x < corner.x + CHUNK_SIZE &&
+                        position.z >= corner.z &&
+                        position.z < corner.z + CHUNK_SIZE
+                    ) {
+                        positions.delete(key);
+                    }
+                }
+            }
+        });
+        // placements are also reported as block updates, the save event makes
+        // sure the block is indexed before the program observes it
+        bot.on("save", (eventName) => {
+            if (!eventName.endsWith("_placed")) return;
+            const name = eventName.slice(0, -"_placed".length);
+            if (!this.blocks.has(name)) return;
+            const block = bot.findBlock({
+                matching: bot.registry.blocksByName[name].id,
+                maxDistance: 8,
+            });
+            if (block) this.addBlock(name, block.position);
+        });
+    }
+
+    addPendingColumn(corner) {
+        this.pendingColumns.set(`${corner.x},${corner.z}`, corner);
+    }
+
+    cellKey(position) {
+        return `${Math.floor(position.x / this.cellSize)},${Math.floor(
+            position.z / this.cellSize
+        )}`;
+    }
+
+    updateEntity(entity) {
+        if (!entity || !entity.position) return;
+        const key = this.cellKey(entity.position);
+        const oldKey = this.entityCells.get(entity.id);
+        if (oldKey === key) return;
+        if (oldKey !== undefined) this.cells.get(oldKey).delete(entity.id);
+        if (!this.cells.has(key)) this.cells.set(key, new Set());
+        this.cells.get(key).add(entity.id);
+        this.entityCells.set(entity.id, key);
+    }
+
+    removeEntity(entity) {
+        const key = this.entityCells.get(entity.id);
+        if (key === undefined) return;
+        const cell = this.cells.get(key);
+        cell.delete(entity.id);
+        if (!cell.size) this.cells.delete(key);
+        this.entityCells.delete(entity.id);
+    }
+
+    // Entities within radius of the bot as [entity, distance] pairs
+    entitiesWithin(radius, filter = () => true) {
+        const center = this.bot.entity.position;
+        const minX = Math.floor((center.x - radius) / this.cellSize);
+        const maxX = Math.floor((center.x + radius) / this.cellSize);
+        const minZ = Math.floor((center.z - radius) / this.cellSize);
+        const maxZ = Math.floor((center.z + radius) / this.cellSize);
+        const result = [];
+        for (let cx = minX; cx <= maxX; cx++) {
+            for (let cz = minZ; cz <= maxZ; cz++) {
+                const cell = this.cells.get(`${cx},${cz}`);
+                if (!cell) continue;
+                for (const id of cell) {
+                    const entity = this.bot.entities[id];
+                    if (!entity || entity === this.bot.entity) continue;
+                    if (!filter(entity)) continue;
+                    const distance = entity.position.distanceTo(center);
+                    if (distance < radius) result.push([entity, distance]);
+                }
+            }
+        }
+        return result;
+    }
+
+    addBlock(name, position) {
+        const positions = this.blocks.get(name);
+        if (!positions) return;
+        positions.set(
+            `${position.x},${position.y},${position.z}`,
+            position.clone()
+        );
+    }
+
+    removeBlock(name, position) {
+        const positions = this.blocks.get(name);
+        if (!positions) return;
+        positions.delete(`${position.x},${position.y},${position.z}`);
+    }
+
+    // Index tracked blocks of the columns loaded within maxDistance since the
+    // last scan. The scan reaches COLUMN_DIAGONAL further so that every
+    // column it clears is covered horizontally.
+    scanPendingColumns(maxDistance) {
+        const center = this.bot.entity.position;
+        let pending = false;
+        for (const [key, corner] of this.pendingColumns) {
+            if (
+                corner.x - maxDistance <= center.x &&
+                center.x < corner.x + CHUNK_SIZE + maxDistance &&
+                corner.z - maxDistance <= center.z &&
+                center.z < corner.z + CHUNK_SIZE + maxDistance
+            ) {
+                this.pendingColumns.delete(key);
+                pending = true;
+            }
+        }
+        if (!pending) return;
+        const ids = [];
+        for (const name of this.blocks.keys()) {
+            ids.push(this.bot.registry.blocksByName[name].id);
+        }
+        this.bot
+            .findBlocks({
+                matching: ids,
+                maxDistance: maxDistance + COLUMN_DIAGONAL,
+                count: 9999,
+            })
+            .forEach((position) => {
+                this.addBlock(this.bot.blockAt(position).name, position);
+            });
+    }
+
+    // Positions of the tracked blocks named `name` within maxDistance of the
+    // bot, nearest first
+    blocksWithin(name, maxDistance) {
+        this.scanPendingColumns(maxDistance);
+        const center = this.bot.entity.position;
+        return Array.from(this.blocks.get(name).values())
+            .map((position) => [position, position.distanceTo(center)])
+            .filter(([, distance]) => distance <= maxDistance)
+            .sort((a, b) => a[1] - b[1])
+            .map(([position]) => position);
+    }
+
+    // Nearest indexed block named `name`, without scanning newly loaded
+    // columns. Used for blocks the bot places itself.
+    nearestBlock(name, maxDistance) {
+        const center = this.bot.entity.position;
+        let nearest = null;
+        let nearestDistance = maxDistance;
+        for (const position of this.blocks.get(name).values()) {
+            const distance = position.distanceTo(center);
+            if (distance <= nearestDistance) {
+                nearest = position;
+                nearestDistance = distance;
+            }
+        }
+        return nearest;
+    }
+}
+
+module.exports = { SpatialIndex };
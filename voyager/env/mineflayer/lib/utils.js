@@ -25,7 +25,43 @@ const getNextTime = () => {
     return gameTimeList[gameTimeCounter];
 };
 
+// Count slash commands that have not been answered by the server yet, so that
+// waits can end as soon as their feedback arrived instead of after a fixed
+// number of ticks. Must be installed before other wrappers of bot.chat.
+const initAckTracker = (bot) => {
+    bot.pendingAcks = 0;
+    const chat = bot.chat;
+    bot.chat = (message) => {
+        if (message.startsWith("/")) {
+            bot.pendingAcks++;
+        }
+        chat(message);
+    };
+    bot.on("messagestr", () => {
+        if (bot.pendingAcks > 0) {
+            bot.pendingAcks--;
+        }
+    });
+};
+
+// Wait for pending command acknowledgements, at most maxTicks. In "fixed" mode
+// always wait maxTicks, unless the running step is aborted.
+const waitForSettle = async (bot, maxTicks, mode = "fixed") => {
+    // always yield one tick so that packets sent just before are flushed
+    let ticks = 0;
+    do {
+        await bot.waitForTicks(1);
+        ticks++;
+    } while (
+        ticks < maxTicks &&
+        (bot.pendingAcks > 0 || (mode === "fixed" && !bot.stepAborted))
+    );
+    bot.pendingAcks = 0;
+};
+
 module.exports = {
     initCounter,
     getNextTime,
+    initAckTracker,
+    waitForSettle,
 };
@@ -0,0 +1,58 @@
+import json
+
+
+class DeltaObservationReconstructor:
+    """
+    Rebuilds full events from a /step response sent in delta observation mode.
+
+    The first event of a step and the final observe event carry every
+    observation. Events in between are marked with `isDelta` and only carry
+    the observations that changed, so each one is completed with the latest
+    known value of everything else. Observations that mineflayer only scans
+    for full events (voxels, blockRecords, nearbyChests) are carried forward
+    from the last full event.
+
+    A `truncated` marker event, sent when mineflayer dropped events to stay
+    within its limits, is a full event and is fed like any other.
+
+    Events can be fed one at a time while a response is being read.
+    """
+
+    def __init__(self):
+        self.state = {}
+
+    def feed(self, event_type, event):
+        """
+        Returns: the event with all observations filled in
+        """
+        if event.pop("isDelta", False):
+            full_event = dict(self.state)
+            full_event.update(event)
+        else:
+            full_event = event
+        self.state = {
+            name: value
+            for name, value in full_event.items()
+            if not name.startswith("on") and name != "truncated"
+        }
+        return [event_type, full_event]
+
+    def expand(self, events):
+        return [self.feed(event_type, event) for event_type, event in events]
+
+
+def iter_events(payload):
+    """
+    Decode the events of a /step response one by one, instead of materializing
+    the whole list before the first one can be processed.
+    """
+    decoder = json.JSONDecoder()
+    end = len(payload)
+    i = payload.index("[") + 1
+    while True:
+        while i < end and payload[i] in " \t\r\n,":
+            i += 1
+        if i >= end or payload[i] == "]":
+            return
+        event, i = decoder.raw_decode(payload, i)
+        yield event
@@ -1,7 +1,8 @@
-import pkg_resources
+import os
+
 import voyager.utils as U
 
 
 def load_prompt(prompt):
-    package_path = pkg_resources.resource_filename("voyager", "")
-    return U.load_text(f"{package_path}/prompts/{prompt}.txt")
+    package_path = os.path.dirname(os.path.abspath(__file__))
+    return U.load_text_cached(f"{package_path}/{prompt}.txt")
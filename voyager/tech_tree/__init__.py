@@ -0,0 +1,239 @@
+import functools
+import json
+import os
+
+from voyager.utils.task_utils import item_keys, item_matches, parse_task, singular
+
+
+class TechTree:
+    """
+    Item, recipe and tool tier graph exported from minecraft-data by
+    export_tech_tree.js, used to tell whether a task can be reached from the
+    current inventory before any rollout is spent on it.
+
+    An item is obtained by crafting (ingredients, and a crafting table for 3x3
+    recipes), smelting (an input and a furnace), mining a block (with one of
+    the tools that harvest it) or killing a mob. Quantities are ignored: an
+    item in the inventory counts as available in any amount.
+
+    The chain of an item only depends on the inventory items it may need,
+    so it is searched once per such subset of the inventory and reused by
+    every later check, e.g. the chain of a stick for every inventory whose
+    only wood is some oak_log.
+    """
+
+    # blocks that are used where they are placed, so a nearby one is as good as one held
+    STATIONS = ("crafting_table", "furnace")
+
+    def __init__(self, items, blocks, max_cached_chains=100_000):
+        self.items = items
+        self.blocks = blocks
+        self.max_cached_chains = max_cached_chains
+        self._closures = {}
+        self._chains = {}
+
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            path = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "tech_tree.json"
+            )
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        return cls(data["items"], data["blocks"])
+
+    def missing(self, item, inventory):
+        """
+        Returns: the items to obtain, in order, before `item` can be obtained,
+        or None if it cannot be obtained at all
+        """
+        chain = self._Search(self, inventory).chain(item)
+        return None if chain is None else chain[:-1] if chain else []
+
+    def missing_to_mine(self, block, inventory):
+        """
+        Returns: the items to obtain before `block` can be mined, or None
+        """
+        return self._Search(self, inventory).tool_chain(block)
+
+    def gathered(self, item):
+        """
+        Whether `item` is gathered in the world, by mining or killing, rather
+        than made from other items. Storage blocks, e.g. raw_iron_block for
+        raw_iron, do not count as a way to make an item.
+        """
+        entry = self.items.get(item, {})
+        if not (entry.get("mine") or entry.get("kill")):
+            return False
+        sources = [i for ingredients, _, _ in entry.get("craft", []) for i in ingredients]
+        sources += entry.get("smelt", [])
+        return all(item in self.closure(source) for source in sources)
+
+    def cached_chain(self, item, inventory):
+        """
+        Returns: the chain of `item`, given the items of its closure held
+        """
+        key = (item, frozenset(inventory))
+        if key not in self._chains:
+            if len(self._chains) >= self.max_cached_chains:
+                self._chains.clear()
+            self._chains[key] = self._Search(self, inventory).search(item)
+        return self._chains[key]
+
+    def closure(self, item):
+        """
+        Returns: every item the search for `item` may look at
+        """
+        return self._reach(item)[0]
+
+    def relevant(self, item):
+        """
+        Returns: every item that changes the chain of `item` when held, the
+        closure and the higher tier tools
+        """
+        return self._reach(item)[1]
+
+    def _reach(self, item):
+        if item not in self._closures:
+            seen = set()
+            tools = set()
+            stack = [item]
+            while stack:
+                name = stack.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+                entry = self.items.get(name, {})
+                for ingredients, _, table in entry.get("craft", []):
+                    stack.extend(ingredients)
+                    if table:
+                        stack.append("crafting_table")
+                for source in entry.get("smelt", []):
+                    stack.extend([source, "furnace"])
+                for block in entry.get("mine", []):
+                    harvest_tools = self.blocks.get(block) or []
+                    stack.extend(harvest_tools[:1])
+                    tools.update(harvest_tools)
+            self._closures[item] = (frozenset(seen), frozenset(seen | tools))
+        return self._closures[item]
+
+    def check_task(self, task, inventory, max_missing=2):
+        """
+        :param task: a task of the form "<verb> <quantity> <name>", others are feasible
+        :param inventory: item names, e.g. the inventory, equipment and nearby STATIONS
+        :param max_missing: how many missing gathered items, e.g. oak_log or
+        cobblestone, a feasible task may need. Items crafted or smelted from
+        them are not counted.
+        :return: (feasible, missing items)
+        """
+        parsed = parse_task(task)
+        if parsed is None or parsed["verb"] == "kill":
+            return True, []
+        verb, name = parsed["verb"], parsed["name"]
+        search = self._Search(self, inventory)
+        names = {name, singular(name)}
+        if verb == "cook":
+            names = item_keys(verb, name)
+        chains = []
+        if verb == "mine":
+            keys = item_keys(verb, name) - names
+            blocks = self._candidates(self.blocks, names, keys)
+            chains = [search.tool_chain(block) for block in blocks]
+        if not chains:
+            items = self._candidates(self.items, names, item_keys(verb, name))
+            chains = [search.chain(item) for item in items]
+            chains = [chain[:-1] if chain else chain for chain in chains]
+        if not chains:
+            # not an item we know of, e.g. "Craft 1 wood"
+            return True, []
+        chains = [chain for chain in chains if chain is not None]
+        if not chains:
+            return False, []
+        missing = min(chains, key=lambda chain: (self._num_gathered(chain), len(chain)))
+        return self._num_gathered(missing) <= max_missing, missing
+
+    def _num_gathered(self, chain):
+        return sum(1 for item in chain if self.gathered(item))
+
+    @staticmethod
+    def _candidates(known, exact, keys):
+        """
+        Returns: the `exact` names that are `known`, else the known names
+        matching `keys`, e.g. all logs for "wood log"
+        """
+        candidates = [name for name in exact if name in known]
+        if candidates:
+            return candidates
+        return [name for name in known if item_matches(name, keys)]
+
+    class _Search:
+        def __init__(self, tree, inventory):
+            self.tree = tree
+            self.have = set(inventory)
+            self.memo = {}
+            self.visiting = set()
+            self.hit_cycle = False
+
+        def chain(self, item):
+            """
+            Returns: the shortest chain of missing items ending with `item`
+            """
+            if item in self.have:
+                return []
+            if item in self.memo:
+                return self.memo[item]
+            if item in self.visiting:
+                self.hit_cycle = True
+                return None
+            if self.visiting.isdisjoint(self.tree.closure(item)):
+                # the chain does not depend on where the search started
+                relevant = self.have & self.tree.relevant(item)
+                self.memo[item] = self.tree.cached_chain(item, relevant)
+                return self.memo[item]
+            return self.search(item)
+
+        def search(self, item):
+            outer_hit_cycle, self.hit_cycle = self.hit_cycle, False
+            self.visiting.add(item)
+            entry = self.tree.items.get(item, {})
+            options = []
+            for ingredients, _, table in entry.get("craft", []):
+                parts = [self.chain(ingredient) for ingredient in ingredients]
+                if table:
+                    parts.append(self.chain("crafting_table"))
+                options.append(parts)
+            for source in entry.get("smelt", []):
+                options.append([self.chain(source), self.chain("furnace")])
+            for block in entry.get("mine", []):
+                options.append([self.tool_chain(block)])
+            if entry.get("kill"):
+                options.append([])
+            self.visiting.discard(item)
+            best = None
+            for parts in options:
+                if any(part is None for part in parts):
+                    continue
+                chain = list(dict.fromkeys(i for part in parts for i in part))
+                chain.append(item)
+                if best is None or len(chain) < len(best):
+                    best = chain
+            # results cut short by a cycle depend on where the search started
+            if not self.hit_cycle:
+                self.memo[item] = best
+            self.hit_cycle = outer_hit_cycle or self.hit_cycle
+            return best
+
+        def tool_chain(self, block):
+            tools = self.tree.blocks.get(block)
+            if tools is None:
+                return None
+            if not tools or self.have.intersection(tools):
+                return []
+            # tools are listed from the lowest tier, and obtaining a higher
+            # tier needs the lower one, so only the lowest is searched
+            return self.chain(tools[0])
+
+
+@functools.lru_cache(maxsize=None)
+def load_tech_tree():
+    return TechTree.load()
@@ -0,0 +1,168 @@
+// Export the item/recipe/tool-tier graph of voyager.tech_tree from minecraft-data.
+//
+//     node voyager/tech_tree/export_tech_tree.js [version]
+//
+// minecraft-data is resolved from the mineflayer env, so run `npm install` in
+// voyager/env/mineflayer first. Smelting and mob drops are not part of
+// minecraft-data and are listed below.
+const fs = require("fs");
+const path = require("path");
+
+const SMELTING = {
+    iron_ingot: ["raw_iron", "iron_ore", "deepslate_iron_ore"],
+    gold_ingot: ["raw_gold", "gold_ore", "deepslate_gold_ore"],
+    copper_ingot: ["raw_copper", "copper_ore", "deepslate_copper_ore"],
+    netherite_scrap: ["ancient_debris"],
+    glass: ["sand", "red_sand"],
+    stone: ["cobblestone"],
+    smooth_stone: ["stone"],
+    deepslate: ["cobbled_deepslate"],
+    smooth_sandstone: ["sandstone"],
+    smooth_quartz: ["quartz_block"],
+    brick: ["clay_ball"],
+    nether_brick: ["netherrack"],
+    terracotta: ["clay"],
+    charcoal: [
+        "oak_log",
+        "birch_log",
+        "spruce_log",
+        "jungle_log",
+        "acacia_log",
+        "dark_oak_log",
+        "mangrove_log",
+    ],
+    green_dye: ["cactus"],
+    lime_dye: ["sea_pickle"],
+    dried_kelp: ["kelp"],
+    sponge: ["wet_sponge"],
+    cooked_porkchop: ["porkchop"],
+    cooked_beef: ["beef"],
+    cooked_chicken: ["chicken"],
+    cooked_mutton: ["mutton"],
+    cooked_rabbit: ["rabbit"],
+    cooked_cod: ["cod"],
+    cooked_salmon: ["salmon"],
+    baked_potato: ["potato"],
+};
+
+const MOB_DROPS = {
+    porkchop: ["pig"],
+    beef: ["cow"],
+    leather: ["cow"],
+    mutton: ["sheep"],
+    white_wool: ["sheep"],
+    chicken: ["chicken"],
+    feather: ["chicken"],
+    rabbit: ["rabbit"],
+    rabbit_hide: ["rabbit"],
+    cod: ["cod"],
+    salmon: ["salmon"],
+    ink_sac: ["squid"],
+    string: ["spider"],
+    spider_eye: ["spider"],
+    bone: ["skeleton"],
+    arrow: ["skeleton"],
+    rotten_flesh: ["zombie"],
+    gunpowder: ["creeper"],
+    ender_pearl: ["enderman"],
+    slime_ball: ["slime"],
+};
+
+function loadMcData(version) {
+    const modulePath = require.resolve("minecraft-data", {
+        paths: [
+            process.cwd(),
+            path.join(__dirname, "..", "env", "mineflayer"),
+        ],
+    });
+    return require(modulePath)(version);
+}
+
+function countIngredients(recipe) {
+    const counts = {};
+    const ids = recipe.inShape ? recipe.inShape.flat() : recipe.ingredients;
+    for (const id of ids) {
+        if (id === null || id === undefined) continue;
+        counts[id] = (counts[id] || 0) + 1;
+    }
+    return counts;
+}
+
+function needsCraftingTable(recipe) {
+    if (recipe.inShape) {
+        return (
+            recipe.inShape.length > 2 ||
+            recipe.inShape.some((row) => row.length > 2)
+        );
+    }
+    return (recipe.ingredients || []).length > 4;
+}
+
+function exportTechTree(version) {
+    const mcData = loadMcData(version);
+    const itemName = (id) => mcData.items[id] && mcData.items[id].name;
+    const items = {};
+    const entry = (name) => (items[name] = items[name] || {});
+
+    for (const [resultId, recipes] of Object.entries(mcData.recipes)) {
+        const result = itemName(resultId);
+        if (!result) continue;
+        const variants = new Set();
+        for (const recipe of recipes) {
+            const ingredients = {};
+            for (const [id, count] of Object.entries(
+                countIngredients(recipe)
+            )) {
+                ingredients[itemName(id)] = count;
+            }
+            variants.add(
+                JSON.stringify([
+                    ingredients,
+                    recipe.result.count,
+                    needsCraftingTable(recipe) ? 1 : 0,
+                ])
+            );
+        }
+        entry(result).craft = [...variants].map((v) => JSON.parse(v));
+    }
+
+    // blocks that need a tool list the tools that harvest them, lowest tier
+    // first: harvestTools is keyed by item id, and ids follow the tiers
+    const blocks = {};
+    for (const block of mcData.blocksArray) {
+        if (!block.diggable || !block.drops || block.drops.length === 0) {
+            continue;
+        }
+        blocks[block.name] = Object.keys(block.harvestTools || {}).map(
+            itemName
+        );
+        for (const drop of block.drops) {
+            const name = itemName(
+                typeof drop === "object" ? drop.drop : drop
+            );
+            if (!name) continue;
+            // crafted blocks dropping themselves are not found in the world
+            const crafted = entry(name).craft || SMELTING[name];
+            if (name === block.name && crafted) continue;
+            const mine = (entry(name).mine = entry(name).mine || []);
+            if (!mine.includes(block.name)) mine.push(block.name);
+        }
+    }
+
+    for (const [name, inputs] of Object.entries(SMELTING)) {
+        entry(name).smelt = inputs;
+    }
+    for (const [name, mobs] of Object.entries(MOB_DROPS)) {
+        entry(name).kill = mobs;
+    }
+    return { version, items, blocks };
+}
+
+if (require.main === module) {
+    const version = process.argv[2] || "1.19";
+    const output = path.join(__dirname, "tech_tree.json");
+    fs.writeFileSync(output, JSON.stringify(exportTechTree(version)));
+    console.log(`Wrote ${output}`);
+}
+
+module.exports = { exportTechTree };
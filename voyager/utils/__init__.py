@@ -1,3 +1,6 @@
 from .file_utils import *
 from .json_utils import *
 from .record_utils import EventRecorder
+from .event_store import EventStore
+from .checkpoint_utils import CheckpointWriter
+from .conversation_log import ConversationLog
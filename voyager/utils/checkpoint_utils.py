@@ -0,0 +1,169 @@
+"""
+Crash-safe checkpoint writes.
+"""
+import contextlib
+import json
+import os
+
+from .file_utils import f_join, f_mkdir_in_path, write_temp_file
+
+
+JOURNAL_NAME = ".checkpoint_journal.json"
+TEMP_PREFIX = ".ckpt-tmp-"
+# temp files of CheckpointWriter and of file_utils.dump_text
+TEMP_PREFIXES = (TEMP_PREFIX, ".tmp-")
+
+
+def _fsync_files(fpaths):
+    """
+    Flush the data of each of `fpaths` to disk. Only these files are synced,
+    not every filesystem of the host as os.sync() would.
+    """
+    for fpath in fpaths:
+        fd = os.open(fpath, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _fsync_dirs(dirpaths):
+    """
+    Make renames into `dirpaths` durable. Directories cannot be opened for
+    syncing on every platform, e.g. Windows, where this is skipped.
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    for dirpath in dirpaths:
+        fd = os.open(dirpath or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _write_temp(s, fpath):
+    f_mkdir_in_path(fpath)
+    return write_temp_file(s, fpath, prefix=TEMP_PREFIX)
+
+
+class CheckpointWriter:
+    """
+    Groups checkpoint files into one atomic commit.
+
+    Files are staged in memory, then written to temp files, synced, and
+    renamed into place. A journal listing the pending renames is put in place
+    before the first rename, so a crash halfway through the renames is rolled
+    forward by `recover()` on the next start instead of leaving a mix of old
+    and new files. Temp files left by a crash before the journal was in
+    place are removed by `recover()`.
+
+    Outside of `batch()` every staged file is committed immediately.
+
+    Usage:
+        writer = CheckpointWriter("ckpt")
+        with writer.batch():
+            writer.dump_text(code, "ckpt/skill/code/foo.js")
+            writer.dump_json(skills, "ckpt/skill/skills.json")
+        # synced once per batch, all files updated together
+    """
+
+    def __init__(self, ckpt_dir="ckpt", fsync=True):
+        self.ckpt_dir = ckpt_dir
+        self.fsync = fsync
+        self.journal_path = f_join(ckpt_dir, JOURNAL_NAME)
+        self._staged = {}
+        self._callbacks = []
+        self._batch_depth = 0
+        self.num_commits = 0
+        self.num_syncs = 0
+        self.recover()
+
+    def dump_text(self, s, *fpaths):
+        self._staged[f_join(*fpaths)] = s
+        if not self._batch_depth:
+            self.commit()
+
+    def dump_json(self, data, *fpaths, **kwargs):
+        self.dump_text(json.dumps(data, **kwargs), *fpaths)
+
+    def after_commit(self, callback):
+        """
+        Run `callback` once the files staged so far are committed, e.g. to
+        persist a vectordb right after the json file it must stay synced with.
+        """
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+        if not self._batch_depth:
+            self.commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer commits until the outermost `batch()` exits. Staged files are
+        still committed if the body raises, since they reflect state that the
+        agents already hold in memory.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.commit()
+
+    def commit(self):
+        if self._staged:
+            self._commit_staged()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _commit_staged(self):
+        staged, self._staged = self._staged, {}
+        renames = [(_write_temp(s, fpath), fpath) for fpath, s in staged.items()]
+        journal_tmp = _write_temp(json.dumps(renames), self.journal_path)
+        if self.fsync:
+            _fsync_files([tmp for tmp, _ in renames] + [journal_tmp])
+            self.num_syncs += 1
+        # the journal rename is the commit point
+        os.replace(journal_tmp, self.journal_path)
+        if self.fsync:
+            _fsync_dirs([os.path.dirname(self.journal_path)])
+        self._apply(renames)
+        self.num_commits += 1
+
+    def recover(self):
+        """
+        Finish a commit interrupted by a crash, if any, and remove the temp
+        files of writes that never committed.
+        """
+        if os.path.exists(self.journal_path):
+            try:
+                with open(self.journal_path, "r") as fp:
+                    renames = json.load(fp)
+            except (OSError, ValueError):
+                # a torn journal was never committed
+                os.remove(self.journal_path)
+            else:
+                print(
+                    f"\033[33mRecovering interrupted checkpoint commit in {self.ckpt_dir}\033[0m"
+                )
+                self._apply(renames)
+        self.remove_temp_files()
+
+    def remove_temp_files(self):
+        if not os.path.isdir(self.ckpt_dir):
+            return
+        for dirpath, _, fnames in os.walk(self.ckpt_dir):
+            for fname in fnames:
+                if fname.startswith(TEMP_PREFIXES):
+                    os.remove(os.path.join(dirpath, fname))
+
+    def _apply(self, renames):
+        for tmp_path, fpath in renames:
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, fpath)
+        if self.fsync:
+            _fsync_dirs({os.path.dirname(fpath) for _, fpath in renames})
+        os.remove(self.journal_path)
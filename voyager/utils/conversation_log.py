@@ -0,0 +1,88 @@
+"""
+Conversation history with repeated messages stored once.
+"""
+import collections.abc
+import hashlib
+import json
+
+
+def message_id(content):
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+class ConversationLog(collections.abc.Sequence):
+    """
+    The (system, human, ai) message triples of a task, read like a list of
+    tuples. Each distinct message is stored once, keyed by a hash of its
+    content, and the triples only hold ids. System messages, which inline the
+    control primitives and retrieved skills, are nearly always repeated
+    across attempts.
+
+    With `sink_path`, every message seen for the first time and every triple
+    is appended to a JSON lines file as it happens:
+        {"type": "message", "id": ..., "content": ...}
+        {"type": "conversation", "task": ..., "ids": [system, human, ai]}
+    A message is written to the sink once per task, so the set of written ids
+    does not grow over the whole run.
+    """
+
+    def __init__(self, sink_path=None, task=None):
+        self.sink_path = sink_path
+        self.messages = {}
+        self.entries = []
+        self.task = task
+
+    def new_task(self, task):
+        """
+        Returns: an empty log for the next task, sharing this log's sink
+        """
+        return ConversationLog(self.sink_path, task=task)
+
+    def intern(self, content):
+        i = message_id(content)
+        if i not in self.messages:
+            self.messages[i] = content
+            if self.sink_path:
+                self._write({"type": "message", "id": i, "content": content})
+        return i
+
+    def append(self, conversation):
+        ids = tuple(self.intern(content) for content in conversation)
+        self.entries.append(ids)
+        if self.sink_path:
+            self._write({"type": "conversation", "task": self.task, "ids": list(ids)})
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._resolve(ids) for ids in self.entries[i]]
+        return self._resolve(self.entries[i])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def to_json(self):
+        """
+        Returns: the compact form, {"messages": {id: content}, "conversations": [[id, ...]]}
+        """
+        return {
+            "messages": dict(self.messages),
+            "conversations": [list(ids) for ids in self.entries],
+        }
+
+    @classmethod
+    def from_json(cls, data, task=None):
+        """
+        Returns: a log read back from the compact form of `to_json()`, which
+        reads like the list of (system, human, ai) tuples again
+        """
+        log = cls(task=task)
+        log.messages = dict(data["messages"])
+        log.entries = [tuple(ids) for ids in data["conversations"]]
+        return log
+
+    def _resolve(self, ids):
+        return tuple(self.messages[i] for i in ids)
+
+    def _write(self, record):
+        with open(self.sink_path, "a") as fp:
+            fp.write(json.dumps(record) + "\n")
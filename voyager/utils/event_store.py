@@ -0,0 +1,193 @@
+"""
+Append-only, compressed storage for the events returned by each env step.
+"""
+import gzip
+import json
+import os
+import time
+
+from .file_utils import f_join, f_mkdir
+
+
+def load_json_lines(fpath):
+    """
+    Returns: the values of a JSON lines file. A torn last line, left by a crash
+    in the middle of an append, is cut off the file so that later appends
+    start on a line of their own.
+    """
+    values = []
+    good = 0
+    with open(fpath, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                values.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+    if good < os.path.getsize(fpath):
+        with open(fpath, "r+b") as fp:
+            fp.truncate(good)
+    return values
+
+
+class StringTable:
+    """
+    Interns repeated strings (block, item, biome and entity names) as ints.
+    Backed by an append-only file with one JSON string per line, so ids are
+    stable across resumes.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.strings = []
+        self.ids = {}
+        if os.path.exists(fpath):
+            # ids are line numbers, a torn line must not shift the next ones
+            for string in load_json_lines(fpath):
+                self.ids[string] = len(self.strings)
+                self.strings.append(string)
+        self._pending = []
+
+    def intern(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            self._pending.append(string)
+        return self.ids[string]
+
+    def lookup(self, i):
+        return self.strings[i]
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.fpath, "a") as fp:
+            for string in self._pending:
+                fp.write(json.dumps(string) + "\n")
+        self._pending = []
+
+
+class EventStore:
+    """
+    Stores each `record()` call as one line of compact JSON in a gzip segment.
+    Every record is its own gzip member, appended to the current segment, so a
+    segment can be read from any indexed offset without decompressing the
+    records before it. Segments roll over after `segment_size` records.
+
+    Layout of `root`:
+        strings.jsonl           interned strings, one per line
+        index.jsonl             {"iteration", "task", "time", "segment", "offset"}
+        segment_00000.jsonl.gz  gzip members, one per record
+    """
+
+    def __init__(self, root, segment_size=256):
+        self.root = root
+        self.segment_size = segment_size
+        f_mkdir(root)
+        self.strings = StringTable(f_join(root, "strings.jsonl"))
+        self.index_path = f_join(root, "index.jsonl")
+        self.index = []
+        if os.path.exists(self.index_path):
+            self.index = load_json_lines(self.index_path)
+
+    def segment_path(self, segment):
+        return f_join(self.root, f"segment_{segment:05d}.jsonl.gz")
+
+    def append(self, events, *, task, iteration):
+        segment = len(self.index) // self.segment_size
+        fpath = self.segment_path(segment)
+        payload = json.dumps(
+            [self.encode_event(event_type, event) for event_type, event in events],
+            separators=(",", ":"),
+        )
+        # the string table must be on disk before any record that refers to it
+        self.strings.flush()
+        offset = os.path.getsize(fpath) if os.path.exists(fpath) else 0
+        with gzip.open(fpath, "ab") as fp:
+            fp.write(payload.encode("utf-8") + b"\n")
+        entry = {
+            "iteration": iteration,
+            "task": task,
+            "time": time.time(),
+            "segment": segment,
+            "offset": offset,
+        }
+        with open(self.index_path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
+        self.index.append(entry)
+        return entry
+
+    def read(self, entry):
+        with open(self.segment_path(entry["segment"]), "rb") as fp:
+            fp.seek(entry["offset"])
+            with gzip.GzipFile(fileobj=fp) as gz:
+                payload = json.loads(gz.readline())
+        return [self.decode_event(event) for event in payload]
+
+    def entries(self, *, iteration=None, task=None):
+        """
+        Returns: index entries, optionally filtered by iteration or task
+        """
+        return [
+            entry
+            for entry in self.index
+            if (iteration is None or entry["iteration"] == iteration)
+            and (task is None or entry["task"] == task)
+        ]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for entry in self.index:
+            yield entry, self.read(entry)
+
+    def encode_event(self, event_type, event):
+        event = dict(event)
+        intern = self.strings.intern
+        if isinstance(event.get("inventory"), dict):
+            event["inventory"] = [
+                [intern(name), count] for name, count in event["inventory"].items()
+            ]
+        for key in ["voxels", "blockRecords"]:
+            if isinstance(event.get(key), list):
+                event[key] = [intern(name) for name in event[key]]
+        if isinstance(event.get("status"), dict):
+            status = event["status"] = dict(event["status"])
+            if isinstance(status.get("biome"), str):
+                status["biome"] = intern(status["biome"])
+            if isinstance(status.get("equipment"), list):
+                status["equipment"] = [
+                    intern(name) if name is not None else None
+                    for name in status["equipment"]
+                ]
+            if isinstance(status.get("entities"), dict):
+                status["entities"] = [
+                    [intern(name), distance]
+                    for name, distance in status["entities"].items()
+                ]
+        return [event_type, event]
+
+    def decode_event(self, encoded):
+        event_type, event = encoded
+        lookup = self.strings.lookup
+        if isinstance(event.get("inventory"), list):
+            event["inventory"] = {lookup(i): count for i, count in event["inventory"]}
+        for key in ["voxels", "blockRecords"]:
+            if isinstance(event.get(key), list):
+                event[key] = [lookup(i) for i in event[key]]
+        status = event.get("status")
+        if isinstance(status, dict):
+            if isinstance(status.get("biome"), int):
+                status["biome"] = lookup(status["biome"])
+            if isinstance(status.get("equipment"), list):
+                status["equipment"] = [
+                    lookup(i) if i is not None else None for i in status["equipment"]
+                ]
+            if isinstance(status.get("entities"), list):
+                status["entities"] = {
+                    lookup(i): distance for i, distance in status["entities"]
+                }
+        return [event_type, event]
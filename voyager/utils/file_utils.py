@@ -546,9 +546,53 @@ def load_text_lines(*fpaths):
     return load_text(*fpaths, by_lines=True)
 
 
-def dump_text(s, *fpaths):
-    with open(f_join(*fpaths), "w") as fp:
+_text_cache = {}
+
+
+def load_text_cached(*fpaths):
+    """
+    Like load_text, but each file is read once per process. With the env var
+    VOYAGER_WATCH_FILES=1, files are read again when their mtime changes, for
+    editing prompts and primitives during development.
+    """
+    fpath = f_join(*fpaths)
+    mtime = None
+    if os.environ.get("VOYAGER_WATCH_FILES") == "1":
+        mtime = os.path.getmtime(fpath)
+    cached = _text_cache.get(fpath)
+    if cached is None or cached[0] != mtime:
+        cached = _text_cache[fpath] = (mtime, load_text(fpath))
+    return cached[1]
+
+
+def write_temp_file(s, *fpaths, prefix=".tmp-"):
+    """
+    Write `s` to a new temp file in the same dir as fpath, so that it can later
+    be renamed over fpath atomically.
+
+    Returns: path of the temp file
+    """
+    fpath = f_join(*fpaths)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=prefix + os.path.basename(fpath) + ".",
+        dir=os.path.dirname(fpath) or ".",
+    )
+    with os.fdopen(fd, "w") as fp:
         fp.write(s)
+    # mkstemp creates 0600 files, match the permissions of a plain open()
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)
+    return tmp_path
+
+
+def dump_text(s, *fpaths):
+    """
+    Write through a temp file and rename it into place, so that a crash never
+    leaves a half-written file behind.
+    """
+    fpath = f_join(*fpaths)
+    os.replace(write_temp_file(s, fpath), fpath)
 
 
 def dump_text_lines(lines: list[str], *fpaths, add_newline=True):
@@ -1,7 +1,8 @@
+import collections
 import json
 import re
-from typing import Any, Dict, Union
-from .file_utils import f_join
+from typing import Any, Dict, Tuple, Union
+from .file_utils import f_join, dump_text
 
 
 def json_load(*file_path, **kwargs):
@@ -15,9 +16,7 @@ def json_loads(string, **kwargs):
 
 
 def json_dump(data, *file_path, **kwargs):
-    file_path = f_join(file_path)
-    with open(file_path, "w") as fp:
-        json.dump(data, fp, **kwargs)
+    dump_text(json.dumps(data, **kwargs), f_join(file_path))
 
 
 def json_dumps(data, **kwargs):
@@ -113,80 +112,242 @@ def fix_invalid_escape(json_str: str, error_message: str) -> str:
     return json_str
 
 
+JSON_ESCAPES = set('"\\/bfnrtu')
+JSON_WORDS = {"true", "false", "null"}
+PYTHON_WORDS = {"True": "true", "False": "false", "None": "null"}
+CLOSING = {"{": "}", "[": "]"}
+WORD_CHARS = set(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-+.$"
+)
+
+
+def _skip_space(text: str, j: int) -> int:
+    while j < len(text) and text[j] in " \t\r\n":
+        j += 1
+    return j
+
+
+# a quoted key and its colon, e.g. the next member after a missing comma
+QUOTED_KEY = re.compile(r"""(["'])[^"'\\\n]*\1\s*:""")
+
+
+def _closes_string(text: str, i: int) -> bool:
+    """
+    Whether the quote at `i` ends the string, judged by what follows it. LLMs
+    often quote words inside strings without escaping them, as in
+    "the word "end", ok", so a comma only ends the string if a value or key
+    follows it.
+    """
+    j = _skip_space(text, i + 1)
+    if j == len(text) or text[j] in ":}]":
+        return True
+    if text[j] != ",":
+        return QUOTED_KEY.match(text, j) is not None
+    j = _skip_space(text, j + 1)
+    if j == len(text) or text[j] in "\"'{[}]":
+        return True
+    k = j
+    while k < len(text) and text[k] in WORD_CHARS:
+        k += 1
+    if k == j:
+        return False
+    word = text[j:k]
+    if word in JSON_WORDS or word in PYTHON_WORDS or _is_number(word):
+        return True
+    # an unquoted key, or an unquoted value in a list
+    k = _skip_space(text, k)
+    return k == len(text) or text[k] in ":,}]"
+
+
+def _find_start(text: str, expect: str = None) -> int:
+    """
+    Returns: where the JSON starts, the first "{" unless `expect` is "array"
+    or the text has no object, or -1
+    """
+    if expect == "array":
+        return text.find("[")
+    begin = text.find("{")
+    if begin >= 0 or expect == "object":
+        return begin
+    return text.find("[")
+
+
+def repair_json(text: str, expect: str = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Extract the outermost JSON object or array from LLM output and repair it
+    in a single pass over the text.
+
+    Repaired faults: text around the JSON, unquoted keys and string values,
+    single quoted strings, Python literals, invalid escapes, unescaped quotes
+    and control characters in strings, missing and trailing commas, stray and
+    unclosed brackets.
+
+    :param expect: "object" or "array", the top-level type the caller wants,
+    so that brackets in text before the JSON are skipped. By default an
+    object is preferred, as in "Inventory [oak_log]: {...}".
+    Returns: the repaired JSON string, and how many times each fault was fixed
+    """
+    fixes = collections.Counter()
+    begin = _find_start(text, expect)
+    if begin < 0:
+        return text, dict(fixes)
+    if text[:begin].strip():
+        fixes["surrounding_text"] += 1
+    out = []
+    stack = []
+    expect_key = False
+    # a value was just completed, the next one needs a comma first
+    after_value = False
+    # the quote char of the open string, if any
+    quote = None
+    i = begin
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if quote is not None:
+            if c == "\\":
+                nxt = text[i + 1] if i + 1 < n else ""
+                if quote == "'" and nxt == "'":
+                    out.append("'")
+                    i += 2
+                    continue
+                if nxt in JSON_ESCAPES and nxt:
+                    out.append(c + nxt)
+                    i += 2
+                    continue
+                # drop the backslash of an invalid escape
+                fixes["invalid_escape"] += 1
+                i += 1
+                continue
+            if c == quote and (quote == "'" or _closes_string(text, i)):
+                out.append('"')
+                quote = None
+                after_value = True
+            elif c == '"':
+                fixes["unescaped_quote"] += 1
+                out.append('\\"')
+            elif c < " ":
+                fixes["control_character"] += 1
+                out.append(json.dumps(c)[1:-1])
+            else:
+                out.append(c)
+            i += 1
+            continue
+
+        if c in " \t\r\n":
+            out.append(c)
+            i += 1
+            continue
+        if after_value and (c in "\"'{[" or c in WORD_CHARS):
+            fixes["missing_comma"] += 1
+            out.append(",")
+            expect_key = stack[-1] == "{"
+        after_value = False
+        if c == '"' or c == "'":
+            if c == "'":
+                fixes["single_quotes"] += 1
+            quote = c
+            out.append('"')
+            expect_key = False
+        elif c in "{[":
+            stack.append(c)
+            out.append(c)
+            expect_key = c == "{"
+        elif c in "}]":
+            if not stack or CLOSING[stack[-1]] != c:
+                fixes["stray_bracket"] += 1
+                i += 1
+                continue
+            _drop_trailing_comma(out, fixes)
+            stack.pop()
+            out.append(c)
+            if not stack:
+                break
+            expect_key = False
+            after_value = True
+        elif c == ",":
+            out.append(c)
+            expect_key = stack[-1] == "{"
+        elif c in WORD_CHARS:
+            j = i
+            while j < n and text[j] in WORD_CHARS:
+                j += 1
+            word = text[i:j]
+            # a key waits for its colon, a value for a comma
+            after_value = not expect_key
+            if expect_key:
+                fixes["unquoted_key"] += 1
+                out.append(f'"{word}"')
+            elif word in PYTHON_WORDS:
+                fixes["python_literal"] += 1
+                out.append(PYTHON_WORDS[word])
+            elif word in JSON_WORDS or _is_number(word):
+                out.append(word)
+            else:
+                fixes["unquoted_value"] += 1
+                out.append(json.dumps(word))
+            expect_key = False
+            i = j
+            continue
+        else:
+            out.append(c)
+        i += 1
+
+    if quote is not None:
+        fixes["unclosed_string"] += 1
+        out.append('"')
+    if stack:
+        _drop_trailing_comma(out, fixes)
+        fixes["unclosed_bracket"] += len(stack)
+        out.extend(CLOSING[c] for c in reversed(stack))
+    elif text[i + 1 :].strip():
+        fixes["surrounding_text"] += 1
+    return "".join(out), dict(fixes)
+
+
+def _drop_trailing_comma(out, fixes):
+    while out and out[-1] in " \t\r\n":
+        out.pop()
+    if out and out[-1] == ",":
+        fixes["trailing_comma"] += 1
+        out.pop()
+
+
+def _is_number(word: str) -> bool:
+    try:
+        float(word)
+    except ValueError:
+        return False
+    return True
+
+
 def correct_json(json_str: str) -> str:
     """
-    Correct common JSON errors.
+    Correct common JSON errors, see repair_json.
     Args:
         json_str (str): The JSON string.
     """
-
     try:
         json.loads(json_str)
         return json_str
-    except json.JSONDecodeError as e:
-        error_message = str(e)
-        if error_message.startswith("Invalid \\escape"):
-            json_str = fix_invalid_escape(json_str, error_message)
-        if error_message.startswith(
-            "Expecting property name enclosed in double quotes"
-        ):
-            json_str = add_quotes_to_property_names(json_str)
-            try:
-                json.loads(json_str)
-                return json_str
-            except json.JSONDecodeError as e:
-                error_message = str(e)
-        if balanced_str := balance_braces(json_str):
-            return balanced_str
-    return json_str
+    except json.JSONDecodeError:
+        return repair_json(json_str)[0]
 
 
 def fix_and_parse_json(
-    json_str: str, try_to_fix_with_gpt: bool = True
+    json_str: str, try_to_fix_with_gpt: bool = True, expect: str = None
 ) -> Union[str, Dict[Any, Any]]:
-    """Fix and parse JSON string"""
+    """Fix and parse JSON string, `expect` is passed on to repair_json"""
     try:
         json_str = json_str.replace("\t", "")
         return json.loads(json_str)
     except json.JSONDecodeError as _:  # noqa: F841
-        json_str = correct_json(json_str)
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError as _:  # noqa: F841
-            pass
-    # Let's do something manually:
-    # sometimes GPT responds with something BEFORE the braces:
-    # "I'm sorry, I don't understand. Please try again."
-    # {"text": "I'm sorry, I don't understand. Please try again.",
-    #  "confidence": 0.0}
-    # So let's try to find the first brace and then parse the rest
-    #  of the string
-    try:
-        brace_index = json_str.index("{")
-        json_str = json_str[brace_index:]
-        last_brace_index = json_str.rindex("}")
-        json_str = json_str[: last_brace_index + 1]
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:  # noqa: F841
-        # if try_to_fix_with_gpt:
-        #     print(
-        #         "Warning: Failed to parse AI output, attempting to fix."
-        #         "\n If you see this warning frequently, it's likely that"
-        #         " your prompt is confusing the AI. Try changing it up"
-        #         " slightly."
-        #     )
-        #     # Now try to fix this up using the ai_functions
-        #     ai_fixed_json = fix_json(json_str, JSON_SCHEMA)
-        #
-        #     if ai_fixed_json != "failed":
-        #         return json.loads(ai_fixed_json)
-        #     else:
-        #         # This allows the AI to react to the error message,
-        #         #   which usually results in it correcting its ways.
-        #         print("Failed to fix ai output, telling the AI.")
-        #         return json_str
-        # else:
-        raise e
+        pass
+    # sometimes GPT responds with something around the braces, or with
+    # unquoted keys, bad escapes, trailing commas or missing braces
+    # all of which are repaired in one pass
+    repaired, _ = repair_json(json_str, expect=expect)
+    return json.loads(repaired)
 
 
 # def fix_json(json_str: str, schema: str) -> str:
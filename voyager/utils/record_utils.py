@@ -1,7 +1,9 @@
+import re
 import time
 
 from .file_utils import *
 from .json_utils import *
+from .event_store import EventStore
 
 
 class EventRecorder:
@@ -10,8 +12,19 @@ class EventRecorder:
         ckpt_dir="ckpt",
         resume=False,
         init_position=None,
+        compact_events=True,
+        snapshot_interval=10,
     ):
+        """
+        :param compact_events: append events to compressed segments in ckpt/events
+        instead of writing one json file per step. Both layouts are read on resume.
+        :param snapshot_interval: write the full running summary every this many
+        iterations. In between, a one-line summary delta is appended per iteration,
+        so resume never has to replay raw events that are already summarized.
+        """
         self.ckpt_dir = ckpt_dir
+        self.compact_events = compact_events
+        self.snapshot_interval = snapshot_interval
         self.item_history = set()
         self.item_vs_time = {}
         self.item_vs_iter = {}
@@ -20,59 +33,176 @@ class EventRecorder:
         self.position_history = [[0, 0]]
         self.elapsed_time = 0
         self.iteration = 0
+        self._new_item_times = []
         f_mkdir(self.ckpt_dir, "events")
+        self.event_store = EventStore(f_join(self.ckpt_dir, "events", "store"))
+        self.snapshot_path = f_join(self.ckpt_dir, "events", "summary.json")
+        self.summary_log_path = f_join(self.ckpt_dir, "events", "summary.jsonl")
         if resume:
             self.resume()
 
     def record(self, events, task):
-        task = re.sub(r'[\\/:"*?<>| ]', "_", task)
-        task = task.replace(" ", "_") + time.strftime(
-            "_%Y%m%d_%H%M%S", time.localtime()
-        )
         self.iteration += 1
         if not self.init_position:
             self.init_position = [
                 events[0][1]["status"]["position"]["x"],
                 events[0][1]["status"]["position"]["z"],
             ]
+        num_positions = len(self.position_history)
+        biomes = set(self.biome_history)
+        self._new_item_times = []
         for event_type, event in events:
+            if event_type == "truncated":
+                self.report_truncation(event["truncated"])
             self.update_items(event)
+            self.update_position(event)
             if event_type == "observe":
                 self.update_elapsed_time(event)
         print(
             f"\033[96m****Recorder message: {self.elapsed_time} ticks have elapsed****\033[0m\n"
             f"\033[96m****Recorder message: {self.iteration} iteration passed****\033[0m"
         )
-        dump_json(events, f_join(self.ckpt_dir, "events", task))
+        if self.compact_events:
+            self.event_store.append(events, task=task, iteration=self.iteration)
+        else:
+            task = re.sub(r'[\\/:"*?<>| ]', "_", task)
+            task = task.replace(" ", "_") + time.strftime(
+                "_%Y%m%d_%H%M%S", time.localtime()
+            )
+            dump_json(events, f_join(self.ckpt_dir, "events", task))
+        delta = {
+            "iteration": self.iteration,
+            "elapsed_time": self.elapsed_time,
+            "init_position": list(self.init_position),
+            "item_vs_time": self._new_item_times,
+            "biomes": sorted(self.biome_history - biomes),
+            "positions": self.position_history[num_positions:],
+        }
+        with open(self.summary_log_path, "a") as fp:
+            fp.write(json_dumps(delta) + "\n")
+        if self.iteration % self.snapshot_interval == 0:
+            self.dump_snapshot()
 
     def resume(self, cutoff=None):
         self.item_history = set()
         self.item_vs_time = {}
         self.item_vs_iter = {}
+        self.biome_history = set()
         self.elapsed_time = 0
         self.position_history = [[0, 0]]
+        self.iteration = 0
+
+        # start from the latest snapshot that does not go past the cutoff
+        if f_exists(self.snapshot_path):
+            snapshot = load_json(self.snapshot_path)
+            if not cutoff or snapshot["iteration"] <= cutoff:
+                self.load_snapshot(snapshot)
+        deltas = {delta["iteration"]: delta for delta in self.load_summary_log()}
+        records = None
+        while not cutoff or self.iteration < cutoff:
+            if self.iteration + 1 in deltas:
+                self.apply_summary_delta(deltas[self.iteration + 1])
+                continue
+            # events that were recorded before the summary log existed, or whose
+            # summary line was lost in a crash
+            if records is None:
+                records = self.list_records()
+            if self.iteration >= len(records):
+                break
+            self.iteration += 1
+            self.replay_events(self.load_record(records[self.iteration - 1]))
+        if not cutoff and records is not None:
+            self.dump_snapshot()
+
+    def list_records(self):
+        """
+        Returns: legacy per-step json files and compact store records, oldest first
+        """
+
+        def is_file_record(name):
+            return is_file(f_join(self.ckpt_dir, "events", name))
 
         def get_timestamp(string):
             timestamp = "_".join(string.split("_")[-2:])
             return time.mktime(time.strptime(timestamp, "%Y%m%d_%H%M%S"))
 
-        records = f_listdir(self.ckpt_dir, "events")
-        sorted_records = sorted(records, key=get_timestamp)
-        for record in sorted_records:
-            self.iteration += 1
-            if cutoff and self.iteration > cutoff:
-                break
-            events = load_json(f_join(self.ckpt_dir, "events", record))
-            if not self.init_position:
-                self.init_position = (
-                    events[0][1]["status"]["position"]["x"],
-                    events[0][1]["status"]["position"]["z"],
-                )
-            for event_type, event in events:
-                self.update_items(event)
-                self.update_position(event)
-                if event_type == "observe":
-                    self.update_elapsed_time(event)
+        records = [
+            (get_timestamp(record), record)
+            for record in f_listdir(self.ckpt_dir, "events", filter=is_file_record)
+            # temp files of writes cut short by a crash start with a dot
+            if not record.startswith(("summary.json", "."))
+        ]
+        records += [(entry["time"], entry) for entry in self.event_store.index]
+        sorted_records = sorted(records, key=lambda record: record[0])
+        return [record for _, record in sorted_records]
+
+    def load_record(self, record):
+        if isinstance(record, dict):
+            return self.event_store.read(record)
+        return load_json(f_join(self.ckpt_dir, "events", record))
+
+    def replay_events(self, events):
+        if not self.init_position:
+            self.init_position = (
+                events[0][1]["status"]["position"]["x"],
+                events[0][1]["status"]["position"]["z"],
+            )
+        for event_type, event in events:
+            self.update_items(event)
+            self.update_position(event)
+            if event_type == "observe":
+                self.update_elapsed_time(event)
+
+    def load_summary_log(self):
+        if not f_exists(self.summary_log_path):
+            return []
+        deltas = []
+        with open(self.summary_log_path, "r") as fp:
+            for line in fp:
+                try:
+                    deltas.append(json_loads(line))
+                except ValueError:
+                    # torn write at the end of the file
+                    break
+        return deltas
+
+    def apply_summary_delta(self, delta):
+        self.iteration = delta["iteration"]
+        self.elapsed_time = delta["elapsed_time"]
+        if not self.init_position:
+            self.init_position = delta["init_position"]
+        for elapsed_time, new_items in delta["item_vs_time"]:
+            self.item_history.update(new_items)
+            self.item_vs_time.setdefault(elapsed_time, []).extend(new_items)
+            self.item_vs_iter.setdefault(self.iteration, []).extend(new_items)
+        self.biome_history.update(delta["biomes"])
+        self.position_history.extend(delta["positions"])
+
+    def dump_snapshot(self):
+        dump_json(
+            {
+                "iteration": self.iteration,
+                "elapsed_time": self.elapsed_time,
+                "init_position": self.init_position,
+                "item_history": sorted(self.item_history),
+                "item_vs_time": list(self.item_vs_time.items()),
+                "item_vs_iter": list(self.item_vs_iter.items()),
+                "biome_history": sorted(self.biome_history),
+                "position_history": self.position_history,
+            },
+            self.snapshot_path,
+        )
+
+    def load_snapshot(self, snapshot):
+        self.iteration = snapshot["iteration"]
+        self.elapsed_time = snapshot["elapsed_time"]
+        if not self.init_position:
+            self.init_position = snapshot["init_position"]
+        self.item_history = set(snapshot["item_history"])
+        self.item_vs_time = {k: v for k, v in snapshot["item_vs_time"]}
+        self.item_vs_iter = {k: v for k, v in snapshot["item_vs_iter"]}
+        self.biome_history = set(snapshot["biome_history"])
+        self.position_history = snapshot["position_history"]
 
     def update_items(self, event):
         inventory = event["inventory"]
@@ -89,6 +219,24 @@ class EventRecorder:
             if self.iteration not in self.item_vs_iter:
                 self.item_vs_iter[self.iteration] = []
             self.item_vs_iter[self.iteration].extend(new_items)
+            self._new_item_times.append([self.elapsed_time + elapsed_time, list(new_items)])
+
+    def report_truncation(self, truncated):
+        """
+        The truncation marker stands in for the events mineflayer dropped and
+        carries their last observation, so items and positions are still
+        tracked. Only the dropped chat, errors and saves are lost.
+        """
+        dropped = ", ".join(
+            f"{count} {event_type}" for event_type, count in truncated["eventTypes"].items()
+        )
+        evicted = ", ".join(
+            f"{count} {name}" for name, count in truncated.get("evicted", {}).items()
+        )
+        print(
+            f"\033[96m****Recorder message: step truncated, "
+            f"dropped events: {dropped or 'none'}, evicted: {evicted or 'none'}****\033[0m"
+        )
 
     def update_elapsed_time(self, event):
         self.elapsed_time += event["status"]["elapsedTime"]
@@ -0,0 +1,145 @@
+import re
+
+NUMBER_WORDS = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+}
+
+TASK_PATTERN = re.compile(
+    r"^(mine|craft|smelt|cook|kill|obtain|collect|get)\s+(\d+|[a-z]+)\s+(.+?)\.?$",
+    re.IGNORECASE,
+)
+
+# items dropped by blocks that do not drop themselves
+MINE_DROPS = {
+    "stone": "cobblestone",
+    "coal_ore": "coal",
+    "iron_ore": "raw_iron",
+    "gold_ore": "raw_gold",
+    "copper_ore": "raw_copper",
+    "diamond_ore": "diamond",
+    "emerald_ore": "emerald",
+    "redstone_ore": "redstone",
+    "lapis_ore": "lapis_lazuli",
+    "lapis_lazuli_ore": "lapis_lazuli",
+    "grass_block": "dirt",
+}
+
+# task words that stand for a family of items
+ITEM_ALIASES = {
+    "wood_log": "log",
+    "wooden_log": "log",
+    "wood": "log",
+    "wood_plank": "planks",
+    "wooden_plank": "planks",
+    "plank": "planks",
+}
+
+# item names that also stand for every item ending with them, e.g. oak_log
+ITEM_FAMILIES = {"log", "planks", "wool", "bed", "boat", "sapling", "leaves"}
+
+VERB_ALIASES = {"collect": "obtain", "get": "obtain"}
+
+
+def parse_task(task):
+    """
+    Parse tasks of the form "<verb> <quantity> <name>", e.g. "Mine 3 iron ore".
+
+    Returns: {"verb", "count", "name"} with name in snake case, or None if the
+    task does not follow the template
+    """
+    match = TASK_PATTERN.match(task.strip())
+    if not match:
+        return None
+    verb, count, name = match.groups()
+    if count.isdigit():
+        count = int(count)
+    elif count.lower() in NUMBER_WORDS:
+        count = NUMBER_WORDS[count.lower()]
+    else:
+        return None
+    name = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+    if not name or count <= 0:
+        return None
+    return {"verb": verb.lower(), "count": count, "name": name}
+
+
+def singular(name):
+    if name.endswith("ies"):
+        return name[:-3] + "y"
+    if name.endswith("ches") or name.endswith("shes") or name.endswith("xes"):
+        return name[:-2]
+    if name.endswith("s") and not name.endswith(("ss", "us")):
+        return name[:-1]
+    return name
+
+
+def item_keys(verb, name):
+    """
+    Returns: names an inventory item may have to count for the task, or end
+    with for the ITEM_FAMILIES among them
+    """
+    keys = {name, singular(name)}
+    keys |= {ITEM_ALIASES[key] for key in keys if key in ITEM_ALIASES}
+    if verb == "mine":
+        keys |= {MINE_DROPS[key] for key in keys if key in MINE_DROPS}
+    if verb == "cook":
+        # the raw food does not count
+        keys = {key if key.startswith("cooked_") else f"cooked_{key}" for key in keys}
+    return keys
+
+
+def item_matches(item, keys):
+    return any(
+        item == key or (key in ITEM_FAMILIES and item.endswith("_" + key))
+        for key in keys
+    )
+
+
+def normalize_task(task):
+    """
+    Key under which equivalent tasks are stored, e.g. "Mine 3 iron ore" and
+    "Mine three iron ores." both give "mine 3 iron_ore".
+    """
+    parsed = parse_task(task)
+    if parsed is None:
+        words = re.findall(r"[a-z0-9]+", task.lower())
+        words = [str(NUMBER_WORDS.get(word, word)) for word in words]
+        return " ".join(singular(word) for word in words)
+    verb = VERB_ALIASES.get(parsed["verb"], parsed["verb"])
+    name = "_".join(singular(word) for word in parsed["name"].split("_"))
+    name = ITEM_ALIASES.get(name, name)
+    return f"{verb} {parsed['count']} {name}"
+
+
+def task_topic(task):
+    """
+    Normalized task without its quantity, e.g. "mine iron_ore" for "Mine 3 iron ore".
+    """
+    key = normalize_task(task)
+    if parse_task(task) is None:
+        return key
+    verb, _, name = key.split(" ")
+    return f"{verb} {name}"
+
+
+def program_task(program_name):
+    """
+    The task a skill name reads as, e.g. "cook seven mutton" for cookSevenMutton
+    and "craft 1 iron pickaxe" for craftIronPickaxeV2.
+    """
+    program_name = re.sub(r"V\d+$", "", program_name)
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", program_name).lower().split()
+    if len(words) > 1 and not (words[1].isdigit() or words[1] in NUMBER_WORDS):
+        words.insert(1, "1")
+    return " ".join(words)
@@ -1,4 +1,3 @@
-import copy
 import json
 import os
 import time
@@ -11,6 +10,8 @@ from .agents import ActionAgent
 from .agents import CriticAgent
 from .agents import CurriculumAgent
 from .agents import SkillManager
+from .agents.llm_client import configure_llm_client, get_llm_client
+from .agents.observation import Observation
 
 
 # TODO: remove event memory
@@ -22,7 +23,13 @@ class Voyager:
         server_port: int = 3000,
         openai_api_key: str = None,
         env_wait_ticks: int = 20,
+        env_wait_mode: str = "fixed",
         env_request_timeout: int = 600,
+        env_step_timeout: int = None,
+        env_delta_observations: bool = False,
+        env_reuse_bot: bool = True,
+        env_observation_limits: Dict[str, int] = None,
+        env_abort_policy=None,
         max_iterations: int = 160,
         reset_placed_if_failed: bool = False,
         action_agent_model_name: str = "gpt-4",
@@ -34,20 +41,33 @@ class Voyager:
         curriculum_agent_temperature: float = 0,
         curriculum_agent_qa_model_name: str = "gpt-3.5-turbo",
         curriculum_agent_qa_temperature: float = 0,
+        curriculum_agent_qa_fast_model_name: str = None,
         curriculum_agent_warm_up: Dict[str, int] = None,
         curriculum_agent_core_inventory_items: str = r".*_log|.*_planks|stick|crafting_table|furnace"
         r"|cobblestone|dirt|coal|.*_pickaxe|.*_sword|.*_axe",
         curriculum_agent_mode: str = "auto",
+        curriculum_agent_tech_tree_max_missing: int = 2,
+        curriculum_agent_task_similarity_threshold: float = None,
+        curriculum_agent_max_task_failures: int = 2,
         critic_agent_model_name: str = "gpt-4",
         critic_agent_temperature: float = 0,
         critic_agent_mode: str = "auto",
+        critic_agent_cache_ttl: float = 3600,
+        critic_agent_fast_model_name: str = None,
         skill_manager_model_name: str = "gpt-3.5-turbo",
         skill_manager_temperature: float = 0,
         skill_manager_retrieval_top_k: int = 5,
+        skill_manager_replay_threshold: float = None,
+        skill_replay: bool = False,
         openai_api_request_timeout: int = 240,
+        openai_api_streaming: bool = False,
+        openai_api_requests_per_minute: int = None,
+        openai_api_max_concurrency: int = 4,
+        openai_api_max_retries: int = 6,
         ckpt_dir: str = "ckpt",
         skill_library_dir: str = None,
         resume: bool = False,
+        log_conversations: bool = False,
     ):
         """
         The main class for Voyager.
@@ -61,8 +81,21 @@ class Voyager:
         :param openai_api_key: openai api key
         :param env_wait_ticks: how many ticks at the end each step will wait, if you found some chat log missing,
         you should increase this value
+        :param env_wait_mode: "fixed" to always wait env_wait_ticks around each step, "adaptive" to only wait until
+        pending chat and command acknowledgements have arrived, with env_wait_ticks as a hard cap
         :param env_request_timeout: how many seconds to wait for each step, if the code execution exceeds this time,
         python side will terminate the connection and need to be resumed
+        :param env_step_timeout: how many seconds the code of each step may run before mineflayer stops it and returns
+        an "Execution timed out" error, defaults to 90% of env_request_timeout, 0 for no limit
+        :param env_delta_observations: only send full observations with the first and last event of each step,
+        intermediate events carry what changed and are filled in on the python side
+        :param env_reuse_bot: on reset, keep the mineflayer process and connected bot if they are healthy and only reset
+        the episode, instead of relaunching mineflayer
+        :param env_observation_limits: caps on the events returned per step and on the block records and chests
+        mineflayer remembers, keys are max_events, max_block_records and max_chests. Anything cut is reported by a
+        "truncated" event at the front of the step's events
+        :param env_abort_policy: stream the events of each attempt and abort it early when this policy asks to, e.g.
+        AnyOf(AbortOnError(), AbortWhenStuck()) from voyager.env.abort_policies. None to always run to the end
         :param reset_placed_if_failed: whether to reset placed blocks if failed, useful for building task
         :param action_agent_model_name: action agent model name
         :param action_agent_temperature: action agent temperature
@@ -71,6 +104,8 @@ class Voyager:
         :param curriculum_agent_temperature: curriculum agent temperature
         :param curriculum_agent_qa_model_name: curriculum agent qa model name
         :param curriculum_agent_qa_temperature: curriculum agent qa temperature
+        :param curriculum_agent_qa_fast_model_name: cheaper model asked first to answer curriculum questions,
+        the qa model answers only when it does not know
         :param curriculum_agent_warm_up: info will show in curriculum human message
         if completed task larger than the value in dict, available keys are:
         {
@@ -89,16 +124,35 @@ class Voyager:
         :param curriculum_agent_core_inventory_items: only show these items in inventory before optional_inventory_items
         reached in warm up
         :param curriculum_agent_mode: "auto" for automatic curriculum, "manual" for human curriculum
+        :param curriculum_agent_tech_tree_max_missing: reject proposed tasks that need more missing gathered items
+        (e.g. oak_log, cobblestone, raw_iron) according to the tech tree, None to disable the check
+        :param curriculum_agent_task_similarity_threshold: embedding distance under which a proposed task counts as
+        a tried one, None to only match tasks that are equal after normalizing numbers, plurals and wording
+        :param curriculum_agent_max_task_failures: reject proposals of a task that failed this many times
         :param critic_agent_model_name: critic agent model name
         :param critic_agent_temperature: critic agent temperature
         :param critic_agent_mode: "auto" for automatic critic ,"manual" for human critic
+        :param critic_agent_cache_ttl: seconds a critic verdict is reused for the same task and state, 0 to disable
+        :param critic_agent_fast_model_name: cheaper model asked first by the critic agent,
+        the critic agent model answers only when its verdict is unusable
         :param skill_manager_model_name: skill manager model name
         :param skill_manager_temperature: skill manager temperature
         :param skill_manager_retrieval_top_k: how many skills to retrieve for each task
+        :param skill_manager_replay_threshold: embedding distance under which a skill description matches a task
+        for replay, None to only match skills by the task they solved and by their name
+        :param skill_replay: also replay library skills in learn, see inference. A failed replay still runs in the
+        world and costs a critic call before the action agent is asked
         :param openai_api_request_timeout: how many seconds to wait for openai api
+        :param openai_api_streaming: stream completions, and stop them as soon as the action code block, the
+        curriculum task or the critic json is complete
+        :param openai_api_requests_per_minute: requests per minute allowed for each model, None for no limit
+        :param openai_api_max_concurrency: how many requests all agents may have in flight
+        :param openai_api_max_retries: how many times a request failing with a rate limit or connection error is retried
         :param ckpt_dir: checkpoint dir
         :param skill_library_dir: skill library dir
         :param resume: whether to resume from checkpoint
+        :param log_conversations: also append every conversation to ckpt_dir/conversations.jsonl as it happens, with
+        each distinct message written once per task
         """
         # https://github.com/MineDojo/Voyager/issues/96
         # if gpt-3.5-turbo is used, set skill_manager_retrieval_top_k = 2
@@ -110,23 +164,41 @@ class Voyager:
             azure_login=azure_login,
             server_port=server_port,
             request_timeout=env_request_timeout,
+            step_timeout=env_step_timeout,
+            delta_observations=env_delta_observations,
+            reuse_bot=env_reuse_bot,
+            observation_limits=env_observation_limits,
         )
         self.env_wait_ticks = env_wait_ticks
+        self.env_wait_mode = env_wait_mode
+        self.env_abort_policy = env_abort_policy
         self.reset_placed_if_failed = reset_placed_if_failed
         self.max_iterations = max_iterations
 
         # set openai api key
         os.environ["OPENAI_API_KEY"] = openai_api_key
 
+        # one client for all agents, so rate limits and backoff apply across them
+        configure_llm_client(
+            requests_per_minute=openai_api_requests_per_minute,
+            max_concurrency=openai_api_max_concurrency,
+            max_retries=openai_api_max_retries,
+        )
+
+        # all checkpoint files written in one learning iteration are committed together
+        self.checkpoint_writer = U.CheckpointWriter(ckpt_dir)
+
         # init agents
         self.action_agent = ActionAgent(
             model_name=action_agent_model_name,
             temperature=action_agent_temperature,
             request_timout=openai_api_request_timeout,
+            streaming=openai_api_streaming,
             ckpt_dir=ckpt_dir,
             resume=resume,
             chat_log=action_agent_show_chat_log,
             execution_error=action_agent_show_execution_error,
+            checkpoint_writer=self.checkpoint_writer,
         )
         self.action_agent_task_max_retries = action_agent_task_max_retries
         self.curriculum_agent = CurriculumAgent(
@@ -134,37 +206,58 @@ class Voyager:
             temperature=curriculum_agent_temperature,
             qa_model_name=curriculum_agent_qa_model_name,
             qa_temperature=curriculum_agent_qa_temperature,
+            qa_fast_model_name=curriculum_agent_qa_fast_model_name,
             request_timout=openai_api_request_timeout,
+            streaming=openai_api_streaming,
             ckpt_dir=ckpt_dir,
             resume=resume,
             mode=curriculum_agent_mode,
             warm_up=curriculum_agent_warm_up,
             core_inventory_items=curriculum_agent_core_inventory_items,
+            tech_tree_max_missing=curriculum_agent_tech_tree_max_missing,
+            task_similarity_threshold=curriculum_agent_task_similarity_threshold,
+            max_task_failures=curriculum_agent_max_task_failures,
+            checkpoint_writer=self.checkpoint_writer,
         )
         self.critic_agent = CriticAgent(
             model_name=critic_agent_model_name,
             temperature=critic_agent_temperature,
             request_timout=openai_api_request_timeout,
+            streaming=openai_api_streaming,
             mode=critic_agent_mode,
+            ckpt_dir=ckpt_dir,
+            resume=resume,
+            cache_ttl=critic_agent_cache_ttl,
+            fast_model_name=critic_agent_fast_model_name,
+            checkpoint_writer=self.checkpoint_writer,
         )
         self.skill_manager = SkillManager(
             model_name=skill_manager_model_name,
             temperature=skill_manager_temperature,
             retrieval_top_k=skill_manager_retrieval_top_k,
             request_timout=openai_api_request_timeout,
+            streaming=openai_api_streaming,
             ckpt_dir=skill_library_dir if skill_library_dir else ckpt_dir,
             resume=True if resume or skill_library_dir else False,
+            checkpoint_writer=self.checkpoint_writer,
+            replay_threshold=skill_manager_replay_threshold,
         )
         self.recorder = U.EventRecorder(ckpt_dir=ckpt_dir, resume=resume)
         self.resume = resume
+        self.skill_replay = skill_replay
 
         # init variables for rollout
         self.action_agent_rollout_num_iter = -1
         self.task = None
         self.context = ""
         self.messages = None
-        self.conversations = []
+        self.conversations = U.ConversationLog(
+            sink_path=f"{ckpt_dir}/conversations.jsonl" if log_conversations else None
+        )
         self.last_events = None
+        self.last_inventory = None
+        # the Observation of last_events, once evaluate_step built it
+        self.last_observation = None
 
     def reset(self, task, context="", reset_env=True):
         self.action_agent_rollout_num_iter = 0
@@ -175,6 +268,7 @@ class Voyager:
                 options={
                     "mode": "soft",
                     "wait_ticks": self.env_wait_ticks,
+                    "wait_mode": self.env_wait_mode,
                 }
             )
         difficulty = (
@@ -185,6 +279,7 @@ class Voyager:
             "bot.chat(`/time set ${getNextTime()}`);\n"
             + f"bot.chat('/difficulty {difficulty}');"
         )
+        self.last_inventory = events[-1][1]["inventory"]
         skills = self.skill_manager.retrieve_skills(query=self.context)
         print(
             f"\033[33mRender Action Agent system message with {len(skills)} skills\033[0m"
@@ -198,16 +293,76 @@ class Voyager:
             f"\033[32m****Action Agent human message****\n{human_message.content}\033[0m"
         )
         assert len(self.messages) == 2
-        self.conversations = []
+        self.conversations = self.conversations.new_task(task)
         return self.messages
 
     def close(self):
         self.env.close()
 
+    def evaluate_step(self, events, program_code):
+        """
+        Check the events of an executed program with the critic and prepare
+        the action agent messages of the next attempt.
+
+        Returns: (success, critique)
+        """
+        self.recorder.record(events, self.task)
+        # parsed once and shared by the agents
+        observation = Observation(events)
+        self.action_agent.update_chest_memory(observation.nearby_chests)
+        success, critique = self.critic_agent.check_task_success(
+            events=events,
+            task=self.task,
+            context=self.context,
+            chest_observation=self.action_agent.render_chest_observation(),
+            max_retries=5,
+            observation=observation,
+            inventory_before=self.last_inventory,
+            known_items=self.recorder.item_history,
+        )
+
+        if self.reset_placed_if_failed and not success:
+            # revert all the placing event in the last step
+            blocks = []
+            positions = []
+            for event_type, event in events:
+                if event_type == "onSave" and event["onSave"].endswith("_placed"):
+                    block = event["onSave"].split("_placed")[0]
+                    position = event["status"]["position"]
+                    blocks.append(block)
+                    positions.append(position)
+            new_events = self.env.step(
+                f"await givePlacedItemBack(bot, {U.json_dumps(blocks)}, {U.json_dumps(positions)})",
+                programs=self.skill_manager.programs,
+            )
+            events[-1][1]["inventory"] = new_events[-1][1]["inventory"]
+            events[-1][1]["voxels"] = new_events[-1][1]["voxels"]
+            observation = Observation(events)
+        new_skills = self.skill_manager.retrieve_skills(
+            query=self.context
+            + "\n\n"
+            + self.action_agent.summarize_chatlog(events, observation)
+        )
+        system_message = self.action_agent.render_system_message(skills=new_skills)
+        human_message = self.action_agent.render_human_message(
+            events=events,
+            code=program_code,
+            task=self.task,
+            context=self.context,
+            critique=critique,
+            observation=observation,
+        )
+        # events are not modified after this point, no need to copy them
+        self.last_events = events
+        self.last_inventory = events[-1][1]["inventory"]
+        self.last_observation = observation
+        self.messages = [system_message, human_message]
+        return success, critique
+
     def step(self):
         if self.action_agent_rollout_num_iter < 0:
             raise ValueError("Agent must be reset before stepping")
-        ai_message = self.action_agent.llm(self.messages)
+        ai_message = self.action_agent.generate(self.messages)
         print(f"\033[34m****Action Agent ai message****\n{ai_message.content}\033[0m")
         self.conversations.append(
             (self.messages[0].content, self.messages[1].content, ai_message.content)
@@ -219,48 +374,11 @@ class Voyager:
             events = self.env.step(
                 code,
                 programs=self.skill_manager.programs,
+                abort_policy=self.env_abort_policy,
             )
-            self.recorder.record(events, self.task)
-            self.action_agent.update_chest_memory(events[-1][1]["nearbyChests"])
-            success, critique = self.critic_agent.check_task_success(
-                events=events,
-                task=self.task,
-                context=self.context,
-                chest_observation=self.action_agent.render_chest_observation(),
-                max_retries=5,
-            )
-
-            if self.reset_placed_if_failed and not success:
-                # revert all the placing event in the last step
-                blocks = []
-                positions = []
-                for event_type, event in events:
-                    if event_type == "onSave" and event["onSave"].endswith("_placed"):
-                        block = event["onSave"].split("_placed")[0]
-                        position = event["status"]["position"]
-                        blocks.append(block)
-                        positions.append(position)
-                new_events = self.env.step(
-                    f"await givePlacedItemBack(bot, {U.json_dumps(blocks)}, {U.json_dumps(positions)})",
-                    programs=self.skill_manager.programs,
-                )
-                events[-1][1]["inventory"] = new_events[-1][1]["inventory"]
-                events[-1][1]["voxels"] = new_events[-1][1]["voxels"]
-            new_skills = self.skill_manager.retrieve_skills(
-                query=self.context
-                + "\n\n"
-                + self.action_agent.summarize_chatlog(events)
-            )
-            system_message = self.action_agent.render_system_message(skills=new_skills)
-            human_message = self.action_agent.render_human_message(
-                events=events,
-                code=parsed_result["program_code"],
-                task=self.task,
-                context=self.context,
-                critique=critique,
+            success, critique = self.evaluate_step(
+                events, program_code=parsed_result["program_code"]
             )
-            self.last_events = copy.deepcopy(events)
-            self.messages = [system_message, human_message]
         else:
             assert isinstance(parsed_result, str)
             self.recorder.record([], self.task)
@@ -274,7 +392,8 @@ class Voyager:
         info = {
             "task": self.task,
             "success": success,
-            "conversations": self.conversations,
+            # each distinct message once, see U.ConversationLog.from_json
+            "conversations": self.conversations.to_json(),
         }
         if success:
             assert (
@@ -288,8 +407,46 @@ class Voyager:
             )
         return self.messages, 0, done, info
 
-    def rollout(self, *, task, context, reset_env=True):
+    def replay(self):
+        """
+        Run the library skill matching the current task instead of asking the
+        action agent to write one. The attempt does not count as a retry.
+
+        Returns: the step result if the critic confirms the task, else None
+        """
+        program_name = self.skill_manager.find_replay_skill(self.task)
+        if program_name is None:
+            return None
+        print(f"\033[33mReplaying skill {program_name} for task {self.task}\033[0m")
+        program_code = self.skill_manager.skills[program_name]["code"]
+        events = self.env.step(
+            f"await {program_name}(bot);",
+            programs=self.skill_manager.programs,
+            abort_policy=self.env_abort_policy,
+        )
+        success, _ = self.evaluate_step(events, program_code=program_code)
+        if not success:
+            print(f"\033[33mReplaying {program_name} failed, asking the action agent\033[0m")
+            return None
+        info = {
+            "task": self.task,
+            "success": True,
+            # each distinct message once, see U.ConversationLog.from_json
+            "conversations": self.conversations.to_json(),
+            "program_code": program_code,
+            "program_name": program_name,
+            "replayed": True,
+        }
+        return self.messages, 0, True, info
+
+    def rollout(self, *, task, context, reset_env=True, replay=None):
         self.reset(task=task, context=context, reset_env=reset_env)
+        if replay is None:
+            replay = self.skill_replay
+        if replay:
+            result = self.replay()
+            if result is not None:
+                return result
         while True:
             messages, reward, done, info = self.step()
             if done:
@@ -303,6 +460,7 @@ class Voyager:
                 options={
                     "mode": "soft",
                     "wait_ticks": self.env_wait_ticks,
+                    "wait_mode": self.env_wait_mode,
                 }
             )
         else:
@@ -311,64 +469,79 @@ class Voyager:
                 options={
                     "mode": "hard",
                     "wait_ticks": self.env_wait_ticks,
+                    "wait_mode": self.env_wait_mode,
                 }
             )
             self.resume = True
         self.last_events = self.env.step("")
+        self.last_observation = None
 
         while True:
             if self.recorder.iteration > self.max_iterations:
                 print("Iteration limit reached")
                 break
-            task, context = self.curriculum_agent.propose_next_task(
-                events=self.last_events,
-                chest_observation=self.action_agent.render_chest_observation(),
-                max_retries=5,
-            )
-            print(
-                f"\033[35mStarting task {task} for at most {self.action_agent_task_max_retries} times\033[0m"
-            )
-            try:
-                messages, reward, done, info = self.rollout(
-                    task=task,
-                    context=context,
-                    reset_env=reset_env,
+            with self.checkpoint_writer.batch():
+                task, context = self.curriculum_agent.propose_next_task(
+                    events=self.last_events,
+                    chest_observation=self.action_agent.render_chest_observation(),
+                    max_retries=5,
+                    observation=self.last_observation,
                 )
-            except Exception as e:
-                time.sleep(3)  # wait for mineflayer to exit
-                info = {
-                    "task": task,
-                    "success": False,
-                }
-                # reset bot status here
-                self.last_events = self.env.reset(
-                    options={
-                        "mode": "hard",
-                        "wait_ticks": self.env_wait_ticks,
-                        "inventory": self.last_events[-1][1]["inventory"],
-                        "equipment": self.last_events[-1][1]["status"]["equipment"],
-                        "position": self.last_events[-1][1]["status"]["position"],
-                    }
+                print(
+                    f"\033[35mStarting task {task} for at most {self.action_agent_task_max_retries} times\033[0m"
                 )
-                # use red color background to print the error
-                print("Your last round rollout terminated due to error:")
-                print(f"\033[41m{e}\033[0m")
+                try:
+                    messages, reward, done, info = self.rollout(
+                        task=task,
+                        context=context,
+                        reset_env=reset_env,
+                    )
+                except Exception as e:
+                    if not self.env.is_healthy():
+                        time.sleep(3)  # wait for mineflayer to exit
+                    info = {
+                        "task": task,
+                        "success": False,
+                    }
+                    # reset bot status here
+                    self.last_events = self.env.reset(
+                        options={
+                            "mode": "hard",
+                            "wait_ticks": self.env_wait_ticks,
+                            "wait_mode": self.env_wait_mode,
+                            "inventory": self.last_events[-1][1]["inventory"],
+                            "equipment": self.last_events[-1][1]["status"]["equipment"],
+                            "position": self.last_events[-1][1]["status"]["position"],
+                        }
+                    )
+                    self.last_observation = None
+                    # use red color background to print the error
+                    print("Your last round rollout terminated due to error:")
+                    print(f"\033[41m{e}\033[0m")
 
-            if info["success"]:
-                self.skill_manager.add_new_skill(info)
+                if info["success"]:
+                    self.skill_manager.add_new_skill(info)
 
-            self.curriculum_agent.update_exploration_progress(info)
-            print(
-                f"\033[35mCompleted tasks: {', '.join(self.curriculum_agent.completed_tasks)}\033[0m"
-            )
-            print(
-                f"\033[35mFailed tasks: {', '.join(self.curriculum_agent.failed_tasks)}\033[0m"
-            )
+                self.curriculum_agent.update_exploration_progress(info)
+                print(
+                    f"\033[35mCompleted tasks: {', '.join(self.curriculum_agent.completed_tasks)}\033[0m"
+                )
+                print(
+                    f"\033[35mFailed tasks: {', '.join(self.curriculum_agent.failed_tasks)}\033[0m"
+                )
 
         return {
             "completed_tasks": self.curriculum_agent.completed_tasks,
             "failed_tasks": self.curriculum_agent.failed_tasks,
             "skills": self.skill_manager.skills,
+            "llm_stats": get_llm_client().stats(),
+            "cascade_stats": {
+                cascade.name: cascade.stats()
+                for cascade in (
+                    self.critic_agent.cascade,
+                    self.curriculum_agent.qa_cascade,
+                )
+            },
         }
 
     def decompose_task(self, task):
@@ -377,11 +550,18 @@ class Voyager:
                 options={
                     "mode": "hard",
                     "wait_ticks": self.env_wait_ticks,
+                    "wait_mode": self.env_wait_mode,
                 }
             )
         return self.curriculum_agent.decompose_task(task, self.last_events)
 
-    def inference(self, task=None, sub_goals=[], reset_mode="hard", reset_env=True):
+    def inference(
+        self, task=None, sub_goals=[], reset_mode="hard", reset_env=True, replay=True
+    ):
+        """
+        :param replay: run the matching library skill before asking the action agent for code, if the skill
+        solved at least the quantity the task asks for. The action agent is only asked if the critic rejects the result
+        """
         if not task and not sub_goals:
             raise ValueError("Either task or sub_goals must be provided")
         if not sub_goals:
@@ -390,10 +570,12 @@ class Voyager:
             options={
                 "mode": reset_mode,
                 "wait_ticks": self.env_wait_ticks,
+                "wait_mode": self.env_wait_mode,
             }
         )
         self.curriculum_agent.completed_tasks = []
         self.curriculum_agent.failed_tasks = []
+        self.curriculum_agent.task_registry.rebuild([], [])
         self.last_events = self.env.step("")
         while self.curriculum_agent.progress < len(sub_goals):
             next_task = sub_goals[self.curriculum_agent.progress]
@@ -405,6 +587,7 @@ class Voyager:
                 task=next_task,
                 context=context,
                 reset_env=reset_env,
+                replay=replay,
             )
             self.curriculum_agent.update_exploration_progress(info)
             print(